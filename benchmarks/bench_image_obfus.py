@@ -0,0 +1,61 @@
+"""
+比较两种图片哈希破坏模式的吞吐量
+
+用法: python benchmarks/bench_image_obfus.py [图片数量] [宽] [高]
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_obfus import MODE_METADATA, MODE_REENCODE, break_hash_file  # noqa: E402
+
+
+def make_sample(path: str, width: int, height: int) -> int:
+    """生成一张带噪声的 JPEG，体积接近 Pixiv 原图，返回文件大小"""
+    from PIL import Image
+
+    img = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    img.save(path, format="JPEG", quality=95)
+    return os.path.getsize(path)
+
+
+def run(mode: str, src: str, dst_paths: list, executor: ProcessPoolExecutor = None) -> float:
+    start = time.perf_counter()
+    if executor:
+        list(executor.map(break_hash_file, [src] * len(dst_paths), dst_paths, [mode] * len(dst_paths)))
+    else:
+        for dst in dst_paths:
+            break_hash_file(src, dst, mode)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else 4000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "sample.jpg")
+        size = make_sample(src, width, height)
+        dst_paths = [os.path.join(tmp, f"out_{i}.jpg") for i in range(count)]
+        total_mb = size * count / 1024 / 1024
+        print(f"样本: {count} 张 {width}x{height} JPEG，共 {total_mb:.1f} MB")
+
+        with ProcessPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            # 预热进程池
+            list(executor.map(break_hash_file, [src], dst_paths[:1], [MODE_METADATA]))
+            for mode in (MODE_REENCODE, MODE_METADATA):
+                for label, pool in (("单进程", None), (f"进程池x{os.cpu_count()}", executor)):
+                    elapsed = run(mode, src, dst_paths, pool)
+                    print(
+                        f"{mode:<6} {label:<10} 耗时 {elapsed:7.2f}s  "
+                        f"{count / elapsed:8.2f} 张/秒  {total_mb / elapsed:8.1f} MB/秒"
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+比较两种PDF生成方式的峰值内存
+
+用法: python benchmarks/bench_pdf_memory.py [页数] [宽] [高]
+
+每种引擎在独立的子进程中运行，分别统计 Python 堆的峰值（tracemalloc）和进程的最大常驻内存。
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pdf_writer import ENGINE_IMG2PDF, ENGINE_STREAMING, build_pdf  # noqa: E402
+
+
+def make_pages(directory: str, count: int, width: int, height: int) -> list:
+    """生成带噪声的 JPEG 页面，体积接近真实漫画页"""
+    from PIL import Image
+
+    paths = []
+    img = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    for i in range(count):
+        path = os.path.join(directory, f"image_{i}.jpg")
+        img.save(path, format="JPEG", quality=90)
+        paths.append(path)
+    return paths
+
+
+def run_engine(engine: str, directory: str) -> None:
+    """子进程入口：生成PDF并输出内存统计"""
+    paths = sorted(
+        (os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".jpg")),
+        key=lambda p: int(os.path.basename(p)[6:-4]),
+    )
+    tracemalloc.start()
+    start = time.perf_counter()
+    build_pdf(paths, os.path.join(directory, f"out_{engine}.pdf"), engine)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{elapsed:.2f} {peak / 1024 / 1024:.1f} {maxrss / 1024:.1f}")
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else 1400
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_pages(directory, count, width, height)
+        total_mb = sum(os.path.getsize(p) for p in paths) / 1024 / 1024
+        print(f"样本: {count} 页 {width}x{height} JPEG，共 {total_mb:.1f} MB")
+        for engine in (ENGINE_STREAMING, ENGINE_IMG2PDF):
+            output = subprocess.run(
+                [sys.executable, __file__, "--engine", engine, directory],
+                capture_output=True, text=True, check=True,
+            ).stdout.split()
+            elapsed, peak, maxrss = output[-3:]
+            print(f"{engine:<8} 耗时 {elapsed}s  Python堆峰值 {peak} MB  最大常驻内存 {maxrss} MB")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--engine":
+        run_engine(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,232 @@
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, TypedDict
+
+from astrbot.api import logger
+
+# 记录类型
+KIND_PAGE = "page"
+KIND_PDF = "pdf"
+KIND_PREVIEW = "preview"
+
+# temp/<pid>/image_<页码>.<扩展名>
+_PAGE_NAME = re.compile(r"^image_(\d+)\.(jpg|png|gif)$")
+# temp/<pid>/preview_<尺寸>.<扩展名>
+_PREVIEW_NAME = re.compile(r"^preview_([a-z_]+)\.(jpg|png|gif)$")
+
+
+class IndexRecord(TypedDict):
+    """
+    缓存索引记录，path 为相对于插件数据目录的路径
+    """
+
+    path: str
+    kind: str
+    pid: str
+    page: int
+    size: int
+    checksum: str
+    complete: bool
+    last_access: float
+    hits: int
+
+
+class CacheIndex:
+    """
+    基于 SQLite 的缓存索引
+
+    记录每张缓存图片和每个PDF的大小、校验值、是否完整以及访问记录。
+    所有记录在启动时载入内存，查询只需一次字典查找，不再探测文件系统；写入同步落盘到 SQLite。
+    """
+
+    def __init__(self, db_path: Path, base_dir: Path) -> None:
+        """
+        初始化缓存索引
+
+        Args:
+            db_path: SQLite 数据库文件路径
+            base_dir: 插件数据目录，索引中的路径都相对于该目录
+        """
+        self.db_path = Path(db_path)
+        self.base_dir = Path(base_dir)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._records: Dict[str, IndexRecord] = {}
+        self._pages: Dict[Tuple[str, int], str] = {}
+
+    def open(self) -> None:
+        """打开数据库并载入全部记录"""
+        # 启动时的重建在线程池中执行，之后只在事件循环线程中使用
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_files (
+                path TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                pid TEXT NOT NULL DEFAULT '',
+                page INTEGER NOT NULL DEFAULT 0,
+                size INTEGER NOT NULL DEFAULT 0,
+                checksum TEXT NOT NULL DEFAULT '',
+                complete INTEGER NOT NULL DEFAULT 0,
+                last_access REAL NOT NULL DEFAULT 0,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.commit()
+        self._records.clear()
+        self._pages.clear()
+        for row in self._conn.execute(
+            "SELECT path, kind, pid, page, size, checksum, complete, last_access, hits FROM cache_files"
+        ):
+            self._cache(IndexRecord(
+                path=row[0], kind=row[1], pid=row[2], page=row[3], size=row[4],
+                checksum=row[5], complete=bool(row[6]), last_access=row[7], hits=row[8],
+            ))
+
+    def close(self) -> None:
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def rel(self, path: Path) -> str:
+        """转换为索引中使用的相对路径"""
+        path = Path(path)
+        try:
+            return path.relative_to(self.base_dir).as_posix()
+        except ValueError:
+            return path.as_posix()
+
+    def abs_path(self, rel_path: str) -> Path:
+        return self.base_dir / rel_path
+
+    def _cache(self, record: IndexRecord) -> None:
+        self._records[record["path"]] = record
+        if record["kind"] == KIND_PAGE:
+            self._pages[(record["pid"], record["page"])] = record["path"]
+
+    def _uncache(self, rel_path: str) -> Optional[IndexRecord]:
+        record = self._records.pop(rel_path, None)
+        if record and record["kind"] == KIND_PAGE:
+            key = (record["pid"], record["page"])
+            if self._pages.get(key) == rel_path:
+                del self._pages[key]
+        return record
+
+    def _upsert(self, records: Iterable[IndexRecord]) -> None:
+        self._conn.executemany(
+            """
+            INSERT OR REPLACE INTO cache_files (path, kind, pid, page, size, checksum, complete, last_access, hits)
+            VALUES (:path, :kind, :pid, :page, :size, :checksum, :complete, :last_access, :hits)
+            """,
+            list(records),
+        )
+        self._conn.commit()
+
+    def get(self, path: Path) -> Optional[IndexRecord]:
+        return self._records.get(self.rel(path))
+
+    def get_page(self, pid: str, page: int) -> Optional[IndexRecord]:
+        """查询已完整缓存的作品页面"""
+        rel_path = self._pages.get((str(pid), page))
+        if rel_path is None:
+            return None
+        record = self._records[rel_path]
+        return record if record["complete"] else None
+
+    def get_complete(self, path: Path) -> Optional[IndexRecord]:
+        """查询已完整写入的缓存文件"""
+        record = self._records.get(self.rel(path))
+        return record if record and record["complete"] else None
+
+    def records(self) -> List[IndexRecord]:
+        return list(self._records.values())
+
+    def put(
+        self,
+        path: Path,
+        kind: str,
+        size: int,
+        checksum: str = "",
+        pid: str = "",
+        page: int = 0,
+        complete: bool = True,
+    ) -> IndexRecord:
+        """写入或覆盖一条记录"""
+        rel_path = self.rel(path)
+        old = self._uncache(rel_path)
+        record = IndexRecord(
+            path=rel_path, kind=kind, pid=str(pid), page=page, size=size, checksum=checksum,
+            complete=complete, last_access=time.time(), hits=old["hits"] if old else 0,
+        )
+        self._cache(record)
+        self._upsert([record])
+        return record
+
+    def touch(self, path: Path) -> None:
+        """记录一次访问"""
+        record = self._records.get(self.rel(path))
+        if not record:
+            return
+        record["last_access"] = time.time()
+        record["hits"] += 1
+        self._conn.execute(
+            "UPDATE cache_files SET last_access = ?, hits = ? WHERE path = ?",
+            (record["last_access"], record["hits"], record["path"]),
+        )
+        self._conn.commit()
+
+    def remove(self, rel_paths: Iterable[str]) -> None:
+        rel_paths = [p for p in rel_paths if self._uncache(p)]
+        if rel_paths:
+            self._conn.executemany("DELETE FROM cache_files WHERE path = ?", [(p,) for p in rel_paths])
+            self._conn.commit()
+
+    def rebuild(self, temp_dir: Path, pdf_dirs: List[Path]) -> None:
+        """
+        与磁盘上的文件对账
+
+        文件已不存在的记录会被删除；大小不一致或没有记录的文件标记为不完整，之后会被重新下载或生成。
+        """
+        seen = set()
+        changed: List[IndexRecord] = []
+
+        def check(path: Path, kind: str, pid: str = "", page: int = 0) -> None:
+            rel_path = self.rel(path)
+            seen.add(rel_path)
+            stat = path.stat()
+            record = self._records.get(rel_path)
+            if record and record["size"] == stat.st_size:
+                return
+            record = IndexRecord(
+                path=rel_path, kind=kind, pid=pid, page=page, size=stat.st_size, checksum="",
+                complete=False, last_access=stat.st_mtime, hits=0,
+            )
+            self._uncache(rel_path)
+            self._cache(record)
+            changed.append(record)
+
+        if temp_dir.exists():
+            for img_dir in temp_dir.iterdir():
+                if not img_dir.is_dir():
+                    continue
+                for img in img_dir.iterdir():
+                    if not img.is_file():
+                        continue
+                    match = _PAGE_NAME.match(img.name)
+                    if match:
+                        check(img, KIND_PAGE, img_dir.name, int(match.group(1)))
+                    elif _PREVIEW_NAME.match(img.name):
+                        check(img, KIND_PREVIEW, img_dir.name)
+        for pdf_dir in pdf_dirs:
+            if pdf_dir.exists():
+                for pdf in pdf_dir.glob("*.pdf"):
+                    check(pdf, KIND_PDF)
+
+        if changed:
+            self._upsert(changed)
+        self.remove([p for p in list(self._records) if p not in seen])
+        logger.info(f"缓存索引重建完成，共 {len(self._records)} 条记录，{len(changed)} 条待校验")
@@ -0,0 +1,172 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+
+class SingleFlight:
+    """
+    并发请求合并
+
+    同一 key 的调用在进行中时，后来的调用方不会重复执行，而是等待第一次调用的结果。
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        # 被合并（未实际执行）的调用次数
+        self.coalesced = 0
+
+    def _on_done(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 取出异常，避免所有调用方都被取消时出现 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行或加入一次调用
+
+        Args:
+            key: 请求的唯一标识
+            func: 无参协程函数，只有第一个调用方的会被执行
+
+        Returns:
+            Any: func 的返回值
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        else:
+            self.coalesced += 1
+        # 单个调用方被取消时不影响其他等待同一结果的调用方
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def cancel_all(self) -> None:
+        """取消所有进行中的调用并等待其结束"""
+        tasks = list(self._inflight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class BoundedJobQueue:
+    """
+    有界任务队列
+
+    固定数量的 worker 从队列中取出任务并投递到执行器中运行，队列已满时提交方会等待，
+    突发的大量任务不会无限堆积在内存中。
+    """
+
+    def __init__(self, executor: Executor, workers: int = 2, maxsize: int = 16) -> None:
+        """
+        初始化任务队列
+
+        Args:
+            executor: 实际执行任务的线程池或进程池
+            workers: 同时执行的任务数，应与执行器大小一致
+            maxsize: 排队任务数上限
+        """
+        self.executor = executor
+        self.workers = max(1, int(workers))
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, int(maxsize)))
+        self._worker_tasks: List[asyncio.Task] = []
+        self.running = 0
+
+    @property
+    def qsize(self) -> int:
+        """排队中的任务数"""
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        for _ in range(self.workers):
+            self._worker_tasks.append(asyncio.create_task(self._worker()))
+
+    async def submit(self, func: Callable, *args) -> Any:
+        """
+        提交任务并等待结果
+
+        Args:
+            func: 在执行器中运行的函数，使用进程池时必须可以被 pickle
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((func, args, future))
+        return await future
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            func, args, future = await self._queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                self.running += 1
+                try:
+                    result = await loop.run_in_executor(self.executor, func, *args)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    self.running -= 1
+            finally:
+                self._queue.task_done()
+
+    async def close(self) -> None:
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class TokenBucket:
+    """
+    令牌桶限流器
+
+    令牌按固定速率生成，最多积攒 capacity 个；取不到令牌的调用方按到达顺序排队等待，
+    允许短时间的突发请求，同时把长期速率限制在 rate 以内。
+    """
+
+    def __init__(self, rate: float, capacity: float = 1) -> None:
+        """
+        初始化令牌桶
+
+        Args:
+            rate: 每秒生成的令牌数，小于等于 0 时不限流
+            capacity: 令牌桶容量，即允许的突发请求数
+        """
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        # 因限流累计等待的时间（秒）
+        self.waited = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """取出令牌，不足时等待"""
+        if self.rate <= 0:
+            return
+        tokens = min(float(tokens), self.capacity)
+        # 持锁等待，保证先到的调用方先拿到令牌
+        async with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                wait = (tokens - self._tokens) / self.rate
+                self.waited += wait
+                await asyncio.sleep(wait)
+                self._refill()
+            self._tokens -= tokens
@@ -0,0 +1,135 @@
+import sqlite3
+import time
+from pathlib import Path
+from typing import Collection, Iterable, List, Optional, TypedDict
+
+from astrbot.api import logger
+
+
+class DeliveryJob(TypedDict):
+    """
+    一条待推送的订阅消息，pid 为空时只发送 text
+    """
+
+    id: int
+    session: str
+    user_id: str
+    pid: str
+    text: str
+    attempts: int
+
+
+class DeliveryQueue:
+    """
+    基于 SQLite 的订阅推送队列
+
+    推送任务先写入磁盘再发送，发送成功后才删除；重启或适配器异常时未发送的任务会保留下来，之后继续发送。
+    """
+
+    def __init__(self, db_path: Path, max_attempts: int = 5) -> None:
+        """
+        初始化推送队列
+
+        Args:
+            db_path: SQLite 数据库文件路径
+            max_attempts: 单条任务的最大发送次数，超过后丢弃
+        """
+        self.db_path = Path(db_path)
+        self.max_attempts = max(1, int(max_attempts))
+        self._conn: Optional[sqlite3.Connection] = None
+        self.dropped_count = 0
+
+    def open(self) -> None:
+        self._conn = sqlite3.connect(str(self.db_path))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS deliveries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session TEXT NOT NULL,
+                user_id TEXT NOT NULL DEFAULT '',
+                pid TEXT NOT NULL DEFAULT '',
+                text TEXT NOT NULL DEFAULT '',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                created REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_due ON deliveries (next_attempt, id)")
+        self._conn.commit()
+
+    def close(self) -> None:
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM deliveries").fetchone()[0]
+
+    def enqueue(self, sessions: Iterable[str], user_id: str, pid: str = "", text: str = "") -> None:
+        """为每个会话写入一条推送任务"""
+        now = time.time()
+        self._conn.executemany(
+            "INSERT INTO deliveries (session, user_id, pid, text, created) VALUES (?, ?, ?, ?, ?)",
+            [(session, str(user_id), str(pid), text, now) for session in sessions],
+        )
+        self._conn.commit()
+
+    def next_batch(self, exclude_users: Collection[str] = ()) -> List[DeliveryJob]:
+        """
+        取出最早到期的任务所属画师的全部到期任务
+
+        同一画师的任务按写入顺序交给同一个 worker，保证推送顺序；exclude_users 中的画师正在被其他 worker 处理。
+
+        Returns:
+            List[DeliveryJob]: 按写入顺序排列的任务，没有到期任务时为空
+        """
+        now = time.time()
+        placeholders = ",".join("?" * len(exclude_users))
+        exclude_sql = f"AND user_id NOT IN ({placeholders})" if exclude_users else ""
+        row = self._conn.execute(
+            f"SELECT user_id FROM deliveries WHERE next_attempt <= ? {exclude_sql} ORDER BY id LIMIT 1",
+            (now, *exclude_users),
+        ).fetchone()
+        if not row:
+            return []
+        return [
+            DeliveryJob(id=r[0], session=r[1], user_id=r[2], pid=r[3], text=r[4], attempts=r[5])
+            for r in self._conn.execute(
+                "SELECT id, session, user_id, pid, text, attempts FROM deliveries "
+                "WHERE user_id = ? AND next_attempt <= ? ORDER BY id",
+                (row[0], now),
+            )
+        ]
+
+    def next_due_in(self) -> Optional[float]:
+        """距离最早一条任务可以发送的秒数，队列为空时返回 None"""
+        row = self._conn.execute("SELECT MIN(next_attempt) FROM deliveries").fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def ack(self, ids: Iterable[int]) -> None:
+        """发送成功，删除任务"""
+        self._conn.executemany("DELETE FROM deliveries WHERE id = ?", [(job_id,) for job_id in ids])
+        self._conn.commit()
+
+    def retry(self, jobs: Iterable[DeliveryJob], delay: float) -> None:
+        """发送失败，delay 秒后重试；超过最大发送次数的任务直接丢弃"""
+        retry_at = time.time() + delay
+        retried, dropped = [], []
+        for job in jobs:
+            if job["attempts"] + 1 >= self.max_attempts:
+                dropped.append((job["id"],))
+            else:
+                retried.append((retry_at, job["id"]))
+        self._conn.executemany(
+            "UPDATE deliveries SET attempts = attempts + 1, next_attempt = ? WHERE id = ?", retried
+        )
+        self._conn.executemany("DELETE FROM deliveries WHERE id = ?", dropped)
+        self._conn.commit()
+        if dropped:
+            self.dropped_count += len(dropped)
+            logger.warning(f"{len(dropped)} 条订阅推送多次发送失败，已丢弃")
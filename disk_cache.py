@@ -0,0 +1,269 @@
+import asyncio
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, TypedDict
+
+from astrbot.api import logger
+
+from .cache_index import CacheIndex, IndexRecord, KIND_PAGE, KIND_PDF, KIND_PREVIEW
+
+# 淘汰策略
+POLICY_LRU = "LRU"
+POLICY_LFU = "LFU"
+
+# 下载中断或失败留下的临时文件
+_PARTIAL_SUFFIXES = (".part", ".tmp")
+
+
+class CacheEntry(TypedDict):
+    """
+    淘汰单元，temp/ 下以作品目录为单位，persistent/ 下以单个PDF文件为单位
+    """
+
+    size: int
+    last_access: float
+    hits: int
+
+
+class DiskCache:
+    """
+    磁盘缓存管理
+
+    缓存查询都通过 CacheIndex 完成；总大小超过上限时按 LRU 或 LFU 淘汰，
+    正在被请求使用（已 pin）的条目不会被淘汰。
+    索引不记录下载中的 .part/.tmp 文件，清理时删除超过 partial_ttl 未更新的这类文件。
+    """
+
+    def __init__(
+        self,
+        index: CacheIndex,
+        max_bytes: int,
+        policy: str = POLICY_LRU,
+        sweep_interval: int = 1800,
+        temp_dir: Optional[Path] = None,
+        partial_ttl: int = 86400,
+    ) -> None:
+        """
+        初始化磁盘缓存
+
+        Args:
+            index: 缓存索引
+            max_bytes: 缓存总大小上限（字节）
+            policy: 淘汰策略，LRU 或 LFU
+            sweep_interval: 后台清理间隔（秒）
+            temp_dir: 图片临时目录，为空时不清理残留的临时文件
+            partial_ttl: 残留的临时文件超过多久未更新后删除（秒）
+        """
+        self.index = index
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.sweep_interval = sweep_interval
+        self.temp_dir = Path(temp_dir) if temp_dir else None
+        self.partial_ttl = partial_ttl
+        self.entries: Dict[str, CacheEntry] = {}
+        self.total_size = 0
+        self.evicted_count = 0
+        self._pins: Dict[str, int] = {}
+        self._sweeper_task: asyncio.Task = None
+
+    @staticmethod
+    def _entry_key(record: IndexRecord) -> str:
+        if record["kind"] in (KIND_PAGE, KIND_PREVIEW):
+            return str(Path(record["path"]).parent.as_posix())
+        return record["path"]
+
+    def load(self) -> None:
+        """根据缓存索引统计各淘汰单元的大小与访问情况"""
+        self.entries.clear()
+        self.total_size = 0
+        for record in self.index.records():
+            self._account(record)
+        logger.info(f"磁盘缓存共 {len(self.entries)} 项，{self.total_size / 1024 / 1024:.1f} MB")
+
+    def _account(self, record: IndexRecord, sign: int = 1) -> None:
+        """把一条索引记录计入（sign=1）或移出（sign=-1）所属的淘汰单元"""
+        key = self._entry_key(record)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = CacheEntry(size=0, last_access=0, hits=0)
+        entry["size"] += sign * record["size"]
+        entry["hits"] += sign * record["hits"]
+        if sign > 0:
+            entry["last_access"] = max(entry["last_access"], record["last_access"])
+        self.total_size += sign * record["size"]
+
+    def lookup_page(self, pid: str, page: int) -> Optional[Path]:
+        """
+        查询已完整缓存的作品页面，命中时记录访问
+
+        Returns:
+            Optional[Path]: 图片路径，未缓存时返回 None
+        """
+        record = self.index.get_page(pid, page)
+        if not record or not self._exists(record):
+            return None
+        self._touch(record)
+        return self.index.abs_path(record["path"])
+
+    def lookup_file(self, path: Path) -> bool:
+        """查询PDF、预览图等单个文件是否已完整缓存，命中时记录访问"""
+        record = self.index.get_complete(path)
+        if not record or not self._exists(record):
+            return False
+        self._touch(record)
+        return True
+
+    def _exists(self, record: IndexRecord) -> bool:
+        """命中时确认文件仍然存在；文件在插件之外被删除时丢弃记录，由调用方重新下载或生成"""
+        if self.index.abs_path(record["path"]).exists():
+            return True
+        logger.warning(f"缓存文件 {record['path']} 已不存在，将重新生成")
+        self._forget(record)
+        return False
+
+    def _forget(self, record: IndexRecord) -> None:
+        self._account(record, -1)
+        self.index.remove([record["path"]])
+
+    def _touch(self, record: IndexRecord) -> None:
+        self.index.touch(self.index.abs_path(record["path"]))
+        entry = self.entries.get(self._entry_key(record))
+        if entry:
+            entry["last_access"] = record["last_access"]
+            entry["hits"] += 1
+
+    def record_page(self, pid: str, page: int, path: Path, size: int, checksum: str) -> None:
+        """记录一张下载完成的作品页面"""
+        old = self.index.get_page(pid, page)
+        if old and old["path"] != self.index.rel(path):
+            # 同一页换了扩展名，删除旧文件及其索引记录
+            self._forget(old)
+            self.index.abs_path(old["path"]).unlink(missing_ok=True)
+        self._record(path, KIND_PAGE, size, checksum, str(pid), page)
+
+    def record_file(self, path: Path, size: int, checksum: str) -> None:
+        """记录一个生成完成的PDF文件"""
+        self._record(path, KIND_PDF, size, checksum)
+
+    def record_preview(self, pid: str, path: Path, size: int, checksum: str) -> None:
+        """记录一张下载完成的预览图，与作品页面放在同一目录，一起淘汰"""
+        self._record(path, KIND_PREVIEW, size, checksum, str(pid))
+
+    def _record(self, path: Path, kind: str, size: int, checksum: str, pid: str = "", page: int = 0) -> None:
+        old = self.index.get(path)
+        if old:
+            self._account(old, -1)
+        record = self.index.put(path, kind, size, checksum, pid, page, complete=True)
+        self._account(record)
+
+    @contextmanager
+    def pin(self, *paths: Path):
+        """在 with 代码块内禁止淘汰给定的缓存条目"""
+        keys = [self.index.rel(path) for path in paths]
+        for key in keys:
+            self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            for key in keys:
+                self._pins[key] -= 1
+                if self._pins[key] <= 0:
+                    del self._pins[key]
+
+    def is_pinned(self, path: Path) -> bool:
+        return self.index.rel(path) in self._pins
+
+    def _eviction_order(self) -> List[str]:
+        if self.policy == POLICY_LFU:
+            return sorted(self.entries, key=lambda k: (self.entries[k]["hits"], self.entries[k]["last_access"]))
+        return sorted(self.entries, key=lambda k: self.entries[k]["last_access"])
+
+    def sweep(self) -> int:
+        """
+        淘汰缓存直到总大小低于上限
+
+        整个过程中没有 await，检查 pin 和删除文件之间不会有其他请求插入。
+
+        Returns:
+            int: 释放的字节数
+        """
+        freed = self._remove_stale_partials()
+        if self.total_size <= self.max_bytes:
+            return freed
+        entry_files: Dict[str, List[str]] = {}
+        for record in self.index.records():
+            entry_files.setdefault(self._entry_key(record), []).append(record["path"])
+        for key in self._eviction_order():
+            if self.total_size <= self.max_bytes:
+                break
+            if key in self._pins:
+                continue
+            path = self.index.abs_path(key)
+            try:
+                if path.is_dir():
+                    shutil.rmtree(path)
+                elif path.exists():
+                    path.unlink()
+            except Exception as e:
+                logger.error(f"删除缓存 {key} 失败: {e}")
+                continue
+            self.index.remove(entry_files.get(key, []))
+            entry = self.entries.pop(key)
+            self.total_size -= entry["size"]
+            freed += entry["size"]
+            self.evicted_count += 1
+        logger.info(f"磁盘缓存清理完成，释放 {freed / 1024 / 1024:.1f} MB，当前 {self.total_size / 1024 / 1024:.1f} MB")
+        return freed
+
+    def _remove_stale_partials(self) -> int:
+        """
+        删除长时间未更新的 .part/.tmp 文件，只剩下这类文件的作品目录一并删除
+
+        Returns:
+            int: 释放的字节数
+        """
+        if not self.temp_dir or not self.temp_dir.exists():
+            return 0
+        deadline = time.time() - self.partial_ttl
+        freed = 0
+        for img_dir in self.temp_dir.iterdir():
+            if not img_dir.is_dir() or self.is_pinned(img_dir):
+                continue
+            try:
+                for path in img_dir.iterdir():
+                    if path.suffix in _PARTIAL_SUFFIXES and path.stat().st_mtime < deadline:
+                        freed += path.stat().st_size
+                        path.unlink()
+                # 刚创建、还没开始写入的目录不删除
+                if img_dir.stat().st_mtime < deadline and not any(img_dir.iterdir()):
+                    img_dir.rmdir()
+            except Exception as e:
+                logger.error(f"清理临时文件 {img_dir} 失败: {e}")
+        if freed:
+            logger.info(f"已删除残留的临时文件，释放 {freed / 1024 / 1024:.1f} MB")
+        return freed
+
+    async def _sweeper(self) -> None:
+        while True:
+            try:
+                await asyncio.sleep(self.sweep_interval)
+                self.sweep()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"磁盘缓存清理任务异常: {e}")
+
+    def start_sweeper(self) -> None:
+        if not self._sweeper_task:
+            self._sweeper_task = asyncio.create_task(self._sweeper())
+
+    async def stop_sweeper(self) -> None:
+        if self._sweeper_task and not self._sweeper_task.done():
+            self._sweeper_task.cancel()
+            try:
+                await self._sweeper_task
+            except asyncio.CancelledError:
+                pass
+        self._sweeper_task = None
@@ -0,0 +1,83 @@
+import asyncio
+import random
+from typing import Any, Awaitable, Callable, Dict, List
+
+from astrbot.api import logger
+
+from .concurrency import TokenBucket
+
+
+class FanoutDispatcher:
+    """
+    消息扇出分发器
+
+    把同一条消息并发发送给多个会话，每个平台单独限流，发送失败时按指数退避重试。
+    消息链由调用方构建一次后复用，不会为每个会话重复构建。
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, Any], Awaitable[Any]],
+        rate: float = 1,
+        burst: int = 5,
+        retries: int = 3,
+        backoff: float = 2,
+    ) -> None:
+        """
+        初始化分发器
+
+        Args:
+            send: 发送函数，参数为会话ID（unified_msg_origin）和消息链
+            rate: 每个平台每秒最多发送的消息数，小于等于 0 时不限流
+            burst: 每个平台允许连续发送的消息数
+            retries: 单个会话发送失败后的最大重试次数
+            backoff: 首次重试前的等待时间（秒），之后每次翻倍
+        """
+        self.send = send
+        self.rate = rate
+        self.burst = burst
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.sent_count = 0
+        self.failed_count = 0
+
+    def _bucket(self, session: str) -> TokenBucket:
+        # unified_msg_origin 的格式为 "平台:消息类型:会话ID"
+        platform = session.split(":", 1)[0]
+        bucket = self._buckets.get(platform)
+        if bucket is None:
+            bucket = self._buckets[platform] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    async def _send_one(self, session: str, chain: Any) -> bool:
+        bucket = self._bucket(session)
+        for attempt in range(self.retries + 1):
+            await bucket.acquire()
+            try:
+                if await self.send(session, chain) is False:
+                    # 找不到对应的平台，重试也不会成功
+                    logger.error(f"发送消息到 {session} 失败：未找到对应的平台")
+                    return False
+                return True
+            except Exception as e:
+                if attempt >= self.retries:
+                    logger.error(f"发送消息到 {session} 失败，已重试 {self.retries} 次: {e}")
+                    return False
+                delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning(f"发送消息到 {session} 失败，{delay:.1f} 秒后重试: {e}")
+                await asyncio.sleep(delay)
+        return False
+
+    async def deliver(self, sessions: List[str], chain: Any) -> List[str]:
+        """
+        把消息链并发发送给所有会话
+
+        Returns:
+            List[str]: 发送成功的会话
+        """
+        results = await asyncio.gather(*(self._send_one(session, chain) for session in sessions))
+        succeeded = [session for session, ok in zip(sessions, results) if ok]
+        self.sent_count += len(succeeded)
+        self.failed_count += len(sessions) - len(succeeded)
+        return succeeded
@@ -0,0 +1,134 @@
+"""
+图片哈希破坏
+
+这里的函数会被投递到进程池中执行，因此只依赖标准库和 Pillow，且都是模块级函数，可以被 pickle。
+"""
+import hashlib
+import os
+import random
+import struct
+import zlib
+
+# 配置项中的模式名称
+MODE_REENCODE = "重编码"
+MODE_METADATA = "修改元数据"
+MODE_OFF = "关闭"
+
+_JPEG_SOI = b"\xff\xd8"
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_GIF_SIGNATURES = (b"GIF87a", b"GIF89a")
+# PNG 签名(8) + IHDR 块(4 长度 + 4 类型 + 13 数据 + 4 CRC)
+_PNG_IHDR_END = len(_PNG_SIGNATURE) + 25
+_CHUNK_SIZE = 1024 * 1024
+
+
+def guess_extension(img_data: bytes) -> str:
+    """根据文件头判断图片扩展名，无法识别时返回 jpg"""
+    if img_data.startswith(_PNG_SIGNATURE):
+        return "png"
+    if img_data.startswith(_GIF_SIGNATURES):
+        return "gif"
+    return "jpg"
+
+
+def _tweak_pixels(img):
+    """随机修改3个像素，返回 RGB 模式的图片"""
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    width, height = img.size
+    pixels = img.load()
+
+    points = []
+    for _ in range(3):
+        while True:
+            x = random.randint(0, width - 1)
+            y = random.randint(0, height - 1)
+            if (x, y) not in points:
+                points.append((x, y))
+                break
+
+    for x, y in points:
+        r, g, b = pixels[x, y]
+
+        r_change = random.choice([-1, 1])
+        g_change = random.choice([-1, 1])
+        b_change = random.choice([-1, 1])
+
+        new_r = max(0, min(255, r + r_change))
+        new_g = max(0, min(255, g + g_change))
+        new_b = max(0, min(255, b + b_change))
+
+        pixels[x, y] = (new_r, new_g, new_b)
+    return img
+
+
+def _metadata_patch(header: bytes) -> tuple:
+    """
+    根据文件头计算要插入的随机元数据
+
+    Returns:
+        tuple: (插入位置, 插入内容)
+    """
+    salt = os.urandom(16).hex().encode("ascii")
+    if header.startswith(_JPEG_SOI):
+        return len(_JPEG_SOI), b"\xff\xfe" + struct.pack(">H", len(salt) + 2) + salt
+    if header.startswith(_PNG_SIGNATURE):
+        chunk_data = b"Comment\x00" + salt
+        chunk = (
+            struct.pack(">I", len(chunk_data))
+            + b"tEXt"
+            + chunk_data
+            + struct.pack(">I", zlib.crc32(b"tEXt" + chunk_data) & 0xFFFFFFFF)
+        )
+        return _PNG_IHDR_END, chunk
+    return None, salt
+
+
+def _hash_file(path: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def break_hash_file(src_path: str, dst_path: str, mode: str = MODE_REENCODE) -> dict:
+    """
+    对图片文件破坏哈希，结果写入 dst_path
+
+    直接读写文件：重编码模式由 Pillow 从文件解码，元数据模式只在文件头插入数据后分块拷贝剩余部分，
+    不会在内存中复制整张图片。
+
+    Returns:
+        dict: 输出文件的扩展名、大小和 SHA-1 校验值
+    """
+    if mode == MODE_REENCODE:
+        from PIL import Image as ImageP
+
+        with ImageP.open(src_path) as img:
+            img = _tweak_pixels(img)
+            img.save(dst_path, format="JPEG", quality=95, subsampling=0)
+        return {"extension": "jpg", "size": os.path.getsize(dst_path), "checksum": _hash_file(dst_path)}
+
+    sha1 = hashlib.sha1()
+    size = 0
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        header = src.read(_PNG_IHDR_END)
+        extension = guess_extension(header)
+        pos, patch = _metadata_patch(header) if mode == MODE_METADATA else (None, b"")
+        tail = b""
+        if pos is None:
+            # 其他格式把随机字节追加在文件末尾
+            pos, patch, tail = len(header), b"", patch
+        head = header[:pos] + patch + header[pos:]
+        for chunk in iter(lambda: src.read(_CHUNK_SIZE), b""):
+            dst.write(head)
+            sha1.update(head)
+            size += len(head)
+            head = chunk
+        head += tail
+        dst.write(head)
+        sha1.update(head)
+        size += len(head)
+    return {"extension": extension, "size": size, "checksum": sha1.hexdigest()}
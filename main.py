@@ -1,4 +1,4 @@
-from datetime import datetime, date
+from datetime import datetime, date, timedelta, timezone
 from typing import List
 from pathlib import Path
 import aiohttp
@@ -6,6 +6,11 @@ import aiofiles
 import asyncio
 import time
 import random
+import os
+import json
+import hashlib
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 
 from astrbot.api.event import filter, AstrMessageEvent, MessageChain
 from astrbot.api.star import Context, Star, register, StarTools
@@ -14,9 +19,103 @@ from astrbot.api.message_components import *
 
 # 引入所需的第三方库
 from pixivpy3 import AppPixivAPI
-import img2pdf
 
 from .subscription import SubscriptionCenter, SubscriptionData
+from .pixiv_api import AsyncPixivAPI, AccountPool, PixivAccount, _error_message
+from .concurrency import SingleFlight, BoundedJobQueue, TokenBucket
+from .dispatcher import FanoutDispatcher
+from .delivery_queue import DeliveryQueue
+from .resilience import Upstream, CircuitOpenError
+from .mirrors import ImageRoute, MirrorSelector, normalize_host
+from .disk_cache import DiskCache, POLICY_LRU
+from .cache_index import CacheIndex
+from .cache import TTLCache
+from .pdf_writer import build_pdf, ENGINE_STREAMING
+from .image_obfus import break_hash_file, guess_extension, MODE_REENCODE, MODE_OFF
+
+# Pixiv API 在容错策略中的名称
+PIXIV_API_UPSTREAM = "app-api.pixiv.net"
+
+# 下载图片使用的请求头
+DOWNLOAD_HEADERS = {
+    'Referer': 'https://www.pixiv.net/',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# 图片下载：分块大小、单次请求超时和最大尝试次数（每次重试都会断点续传）
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=120, sock_connect=15, sock_read=30)
+DOWNLOAD_ATTEMPTS = 3
+# 图片线路探测：间隔需小于线路统计记录的有效期（10 分钟），保证每条线路都有延迟数据
+MIRROR_PROBE_INTERVAL = 300
+MIRROR_PROBE_TIMEOUT = aiohttp.ClientTimeout(total=15)
+
+# 预览图尺寸，对应作品 image_urls 中的字段；original 表示使用第一页原图
+QUALITY_SQUARE_MEDIUM = "square_medium"
+QUALITY_MEDIUM = "medium"
+QUALITY_LARGE = "large"
+QUALITY_ORIGINAL = "original"
+# 排行榜和画师作品命令中带上该参数时发送原图
+FULL_RES_KEYWORD = "原图"
+
+
+def _parse_content_range(content_range: str) -> tuple:
+    """
+    解析 Content-Range 响应头，如 "bytes 100-199/1000" 或 "bytes */1000"
+
+    Returns:
+        tuple: (起始位置, 文件总大小)，无法解析的部分为 None
+    """
+    start, total = None, None
+    try:
+        range_part, total_part = content_range.split(" ", 1)[1].split("/")
+        if range_part != "*":
+            start = int(range_part.split("-")[0])
+        if total_part != "*":
+            total = int(total_part)
+    except (AttributeError, IndexError, ValueError):
+        pass
+    return start, total
+
+
+# 以PDF形式发送预览的R18排行榜类型
+RANKING_R18_MODES = ["day_r18", "week_r18", "day_r18_ai"]
+# Pixiv 排行榜每天在日本时间中午更新
+RANKING_TIMEZONE = timezone(timedelta(hours=9))
+RANKING_UPDATE_HOUR = 12
+# Pixiv 在中午之后还需要一段时间才能更新完成，这段时间内仍按上一期榜单缓存（秒）
+RANKING_UPDATE_GRACE = 600
+
+# 订阅推送队列：空闲时检查到期任务的间隔、失败后首次重试的等待时间（秒）
+DELIVERY_IDLE_WAIT = 30
+DELIVERY_RETRY_DELAY = 60
+
+# 关注动态模式：以非公开方式关注订阅的画师，每轮最多向下翻页的数量（每页30个作品）
+FOLLOW_RESTRICT = "private"
+FEED_MAX_PAGES = 10
+# 关注和关注动态固定使用的账号序号，账号池中有多个账号时所有关注都集中在这个账号上
+FEED_ACCOUNT = 0
+
+
+def _ranking_cycle(ranking_date: str = None) -> tuple:
+    """
+    计算排行榜的缓存键日期和有效期
+
+    Returns:
+        tuple: (榜单日期, 距离下次排行榜更新完成的秒数)
+    """
+    now = datetime.now(RANKING_TIMEZONE)
+    next_update = now.replace(hour=RANKING_UPDATE_HOUR, minute=0, second=0, microsecond=0)
+    next_update += timedelta(seconds=RANKING_UPDATE_GRACE)
+    if now >= next_update:
+        next_update += timedelta(days=1)
+    ttl = (next_update - now).total_seconds()
+    if ranking_date:
+        # 指定日期的历史榜单不会再变化
+        return ranking_date, max(ttl, 86400)
+    # 当前榜单以上次更新时的日期作为键
+    return (next_update - timedelta(days=1)).date().isoformat(), ttl
+
 
 @register("pid2pdf", "Joker42S", "根据Pixiv ID下载图片并保存为PDF发送", "1.0.3")
 class Pid2PdfPlugin(Star):
@@ -25,14 +124,47 @@ class Pid2PdfPlugin(Star):
         self.config = config
         self.context = context
         self.papi = None
+        # 各上游服务（Pixiv API、图床域名）的重试与熔断策略
+        self.upstreams = {}
         self.temp_dir = None
         self.refresh_token = None
         self.proxy = None
         self.reverse_proxy = None
         self.use_reverse_proxy = False
+        self.mirror_selector = None
         self.egg_trigger_time = 0
         self.egg_trigger_record_file = None
         self.enable_subscription = False
+        self.http_session = None
+        self.prebuild_task = None
+        self.mirror_probe_task = None
+        self.disk_cache = None
+        self.cache_index = None
+        self.download_semaphore = None
+        self.download_concurrency = 4
+        self.obfus_executor = None
+        # 作品元数据缓存，在 initialize 中按配置重建
+        self.meta_cache = TTLCache()
+        # 排行榜缓存，键为 (类型, 日期)，在排行榜更新时过期
+        self.ranking_cache = TTLCache(maxsize=64)
+        # 按 PID / (PID, 页码) 合并并发请求
+        self.single_flight = SingleFlight()
+        self.hash_break_mode = MODE_REENCODE
+        self.pdf_engine = ENGINE_STREAMING
+        self.pdf_queue = None
+        self.download_count = 0
+        self.download_time_total = 0.0
+        self.sub_workers = 4
+        self.sub_feed_mode = False
+        self.push_dispatcher = None
+        self.delivery_queue = None
+        self.delivery_event = asyncio.Event()
+        self.delivery_tasks = []
+        # 正在被推送 worker 处理的画师
+        self._delivering = set()
+        self.sub_rate_limiter = TokenBucket(rate=1, capacity=4)
+        self.sub_cycle_count = 0
+        self.sub_cycle_duration = 0.0
 
     async def initialize(self):
         """插件初始化方法"""
@@ -47,30 +179,100 @@ class Pid2PdfPlugin(Star):
             self.easter_egg = self.config.get("easter_egg", False)
             self.easter_egg_list = self.config.get("easter_egg_list", [])
             self.enable_subscription = self.config.get("enable_subscription", False)
+            self.meta_cache = TTLCache(
+                maxsize=self.config.get("meta_cache_size", 1000),
+                ttl=self.config.get("meta_cache_ttl", 60) * 60,
+            )
             
             # 设置代理（如果配置了）
+            api_timeout = self.config.get("api_timeout", 30)
             _REQUESTS_KWARGS: dict[str, Any] = {
                 'proxies': {
                     'https': self.proxy,
                     'http': self.proxy,
                 },
+                # requests 默认不超时，卡住的连接会一直占用线程池；pixivpy 会把这些参数传给每个请求（包括 auth）
+                'timeout': api_timeout,
                 # 'verify': False,       # PAPI use https, an easy way is disable requests SSL verify
             }
-            # 初始化Pixiv API
-            self.papi = AppPixivAPI(**_REQUESTS_KWARGS)
+            # 账号池：每个 refresh_token 一个 AppPixivAPI 客户端，同步调用都放到各自的线程池中执行，避免阻塞事件循环
+            refresh_tokens = [token for token in self.config.get("refresh_tokens", []) if token]
+            if self.refresh_token and self.refresh_token not in refresh_tokens:
+                refresh_tokens.insert(0, self.refresh_token)
+            accounts = [
+                PixivAccount(
+                    AsyncPixivAPI(
+                        AppPixivAPI(**_REQUESTS_KWARGS),
+                        max_workers=self.config.get("api_workers", 4),
+                        timeout=api_timeout,
+                    ),
+                    token,
+                    rate=self.config.get("account_rate", 2),
+                    burst=self.config.get("account_burst", 5),
+                )
+                for token in refresh_tokens or [""]
+            ]
+            self.upstreams[PIXIV_API_UPSTREAM] = Upstream(
+                PIXIV_API_UPSTREAM,
+                failure_threshold=self.config.get("breaker_threshold", 5),
+                reset_timeout=self.config.get("breaker_reset_timeout", 30),
+            )
+            self.papi = AccountPool(
+                accounts,
+                cooldown=self.config.get("account_cooldown", 5) * 60,
+                upstream=self.upstreams[PIXIV_API_UPSTREAM],
+            )
             # self.papi.set_api_proxy('https://i.pixiv.cat')
             
-            # 使用refresh_token登录
-            if self.refresh_token:
-                try:
-                    self.papi.auth(refresh_token=self.refresh_token)
-                    logger.info("Pixiv API登录成功")
-                except Exception as e:
-                    logger.error(f"Pixiv API登录失败: {e}")
+            # 使用refresh_token登录，之后由后台任务在令牌过期前自动刷新
+            if refresh_tokens:
+                logged_in = await self.papi.login()
+                logger.info(f"Pixiv API登录完成，{logged_in}/{len(refresh_tokens)} 个账号登录成功")
+                if logged_in < len(refresh_tokens):
                     logger.warning("请检查refresh_token是否正确")
             else:
                 logger.warning("未配置Pixiv refresh_token，部分功能可能无法使用")
             
+            # 插件生命周期内共享的下载会话，复用连接与DNS解析结果
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.config.get("download_conn_per_host", 8),
+                ttl_dns_cache=600,
+                keepalive_timeout=60,
+            )
+            self.http_session = aiohttp.ClientSession(connector=connector, headers=DOWNLOAD_HEADERS)
+            # 下载并发控制：单作品并发上限 + 插件全局并发上限
+            self.download_concurrency = max(1, self.config.get("download_concurrency", 4))
+            self.download_semaphore = asyncio.Semaphore(max(1, self.config.get("max_global_downloads", 16)))
+            # 图片下载线路：直连（经过代理）以及配置的反代镜像，按延迟和错误率选择
+            # 开启反代时通常是因为无法直连，反代排在最前，直连只作为兜底
+            mirror_window = self.config.get("mirror_window", 20)
+            use_reverse_proxy = bool(self.use_reverse_proxy and self.reverse_proxy)
+            direct = ImageRoute(proxy=self.proxy, window=mirror_window, fallback=use_reverse_proxy)
+            mirrors = list(self.config.get("image_mirrors", []))
+            if use_reverse_proxy:
+                mirrors.insert(0, self.reverse_proxy)
+            routes = [
+                ImageRoute(mirror, window=mirror_window)
+                for mirror in dict.fromkeys(normalize_host(m) for m in mirrors if m.strip())
+            ]
+            routes.insert(len(routes) if use_reverse_proxy else 0, direct)
+            self.mirror_selector = MirrorSelector(routes)
+            if len(routes) > 1:
+                self.mirror_probe_task = asyncio.create_task(self._mirror_probe_task())
+
+            # 破坏图片哈希是CPU密集操作，放到按CPU核数创建的进程池中执行
+            self.hash_break_mode = self.config.get("hash_break_mode", MODE_REENCODE)
+            self.obfus_executor = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+            self.pdf_engine = self.config.get("pdf_engine", ENGINE_STREAMING)
+            # PDF生成任务队列，由独立进程池并行处理
+            pdf_workers = max(1, self.config.get("pdf_workers", 2))
+            self.pdf_queue = BoundedJobQueue(
+                ProcessPoolExecutor(max_workers=pdf_workers),
+                workers=pdf_workers,
+                maxsize=self.config.get("pdf_queue_size", 16),
+            )
+            self.pdf_queue.start()
+
             self.base_dir = StarTools.get_data_dir(self.plugin_name)
             # 创建临时目录用于存储下载的图片
             self.temp_dir = self.base_dir / "temp"
@@ -80,6 +282,27 @@ class Pid2PdfPlugin(Star):
             self.persistent_dir = self.base_dir / "persistent"
             if not self.persistent_dir.exists():
                 self.persistent_dir.mkdir(parents=True, exist_ok=True)
+            # 内容寻址的排行榜PDF目录
+            self.ranking_pdf_dir = self.persistent_dir / "ranking"
+            if not self.ranking_pdf_dir.exists():
+                self.ranking_pdf_dir.mkdir(parents=True, exist_ok=True)
+            # 缓存索引：记录每张图片和PDF的大小、校验值与完整性，启动时与磁盘对账
+            self.cache_index = CacheIndex(self.persistent_dir / "cache_index.db", self.base_dir)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.cache_index.open)
+            await loop.run_in_executor(
+                None, self.cache_index.rebuild, self.temp_dir, [self.persistent_dir, self.ranking_pdf_dir]
+            )
+            # 磁盘缓存：总大小超过上限时按访问记录淘汰旧的图片目录和PDF
+            self.disk_cache = DiskCache(
+                self.cache_index,
+                max_bytes=self.config.get("cache_max_size", 2048) * 1024 * 1024,
+                policy=self.config.get("cache_eviction_policy", POLICY_LRU),
+                sweep_interval=self.config.get("cache_sweep_interval", 30) * 60,
+                temp_dir=self.temp_dir,
+            )
+            self.disk_cache.load()
+            self.disk_cache.start_sweeper()
             #读本地文件记录
             self.egg_trigger_record_file = self.persistent_dir / "egg_trigger_record.txt"
             if self.egg_trigger_record_file.exists():
@@ -89,11 +312,50 @@ class Pid2PdfPlugin(Star):
                     self.egg_trigger_time = int(self.egg_trigger_time)
                 else:
                     self.egg_trigger_time = 0
-            self.sub_center = SubscriptionCenter(str(self.persistent_dir / "subscriptions.json"), self.refresh_interval * 60)
+            # 订阅更新：并行处理画师的 worker 数量，以及 Pixiv API 调用的速率上限
+            self.sub_workers = max(1, self.config.get("sub_workers", 4))
+            self.sub_feed_mode = self.config.get("sub_feed_mode", False)
+            self.sub_rate_limiter = TokenBucket(
+                rate=self.config.get("sub_api_rate", 1),
+                capacity=self.config.get("sub_api_burst", 4),
+            )
+            # 订阅推送：按平台限流，并发发送给所有订阅群组
+            self.push_dispatcher = FanoutDispatcher(
+                self.context.send_message,
+                rate=self.config.get("push_rate", 1),
+                burst=self.config.get("push_burst", 5),
+                retries=self.config.get("push_retries", 3),
+            )
+            # 持久化的推送队列，发送成功后才删除任务，重启后继续发送
+            self.delivery_queue = DeliveryQueue(
+                self.persistent_dir / "delivery_queue.db",
+                max_attempts=self.config.get("push_max_attempts", 5),
+            )
+            self.delivery_queue.open()
+            pending = len(self.delivery_queue)
+            if pending:
+                logger.info(f"推送队列中有 {pending} 条未发送的订阅消息")
+            self.sub_center = SubscriptionCenter(
+                str(self.persistent_dir / "subscriptions.json"),
+                self.refresh_interval * 60,
+                min_poll_interval=self.config.get("sub_min_poll_interval", 60) * 60,
+                max_poll_interval=self.config.get("sub_max_poll_interval", 168) * 3600,
+            )
             await self.sub_center.initilize()
             if self.enable_subscription:
                 self.sub_center.set_callback(self._handle_sub_update)
                 self.sub_center.start_timer()
+                self.delivery_tasks = [
+                    asyncio.create_task(self._delivery_worker())
+                    for _ in range(max(1, self.config.get("push_workers", 2)))
+                ]
+            # 预生成默认关闭；过滤 R18 时不会发送R18排行榜，也不预生成
+            self.ranking_prebuild_modes = [
+                mode for mode in self.config.get("ranking_prebuild_modes", [])
+                if mode in RANKING_R18_MODES
+            ] if self.config.get("r18_mode", "过滤 R18") != "过滤 R18" else []
+            if self.ranking_prebuild_modes:
+                self.prebuild_task = asyncio.create_task(self._ranking_prebuild_task())
             logger.info(f"Pid2Pdf插件初始化完成，临时目录: {self.temp_dir}")
             
         except Exception as e:
@@ -115,7 +377,19 @@ class Pid2PdfPlugin(Star):
                 return
             #检查本地是否存在PID的PDF文件
             pdf_path = self.persistent_dir / f"pixiv_{pid}.pdf"
-            if pdf_path.exists():
+            # 处理期间禁止磁盘缓存淘汰该作品的图片和PDF
+            with self.disk_cache.pin(self.temp_dir / pid, pdf_path):
+                async for result in self._process_pid2pdf(event, pid, pdf_path):
+                    yield result
+            
+        except Exception as e:
+            logger.error(f"处理PID转PDF时出错: {e}")
+            yield event.plain_result(f"处理过程中出现错误: {str(e)}")
+
+    async def _process_pid2pdf(self, event: AstrMessageEvent, pid: str, pdf_path: Path):
+        """下载作品并生成、发送PDF"""
+        try:
+            if self.disk_cache.lookup_file(pdf_path):
                 # logger.info(f"本地已存在该PID的PDF文件: {pdf_path}")
                 # 发送PDF文件
                 async for result in self._send_pdf(event, pdf_path, pid):
@@ -181,6 +455,18 @@ class Pid2PdfPlugin(Star):
                 yield event.plain_result("Pixiv ID必须是数字")
                 return
             img_path = self.temp_dir / f"{pid}"
+            # 处理期间禁止磁盘缓存淘汰该作品的图片
+            with self.disk_cache.pin(img_path):
+                async for result in self._process_pid(event, pid, img_path):
+                    yield result
+            
+        except Exception as e:
+            logger.error(f"处理PID出错: {e}")
+            yield event.plain_result(f"处理过程中出现错误: {str(e)}")
+
+    async def _process_pid(self, event: AstrMessageEvent, pid: str, img_path: Path):
+        """下载作品并直接发送图片"""
+        try:
             yield event.plain_result(f"开始获取 Pixiv 作品: {pid}，请稍候...")
             # 获取作品详情
             artwork_info = await self._get_artwork_info(pid)
@@ -210,7 +496,7 @@ class Pid2PdfPlugin(Star):
                 info_text += " | R18/R18G作品"
             yield event.plain_result(info_text)
             # 发送图片
-            async for result in self._send_img(event, img_path, pid):
+            async for result in self._send_img(event, image_paths, pid):
                 yield result
             
         except Exception as e:
@@ -218,40 +504,51 @@ class Pid2PdfPlugin(Star):
             yield event.plain_result(f"处理过程中出现错误: {str(e)}")
 
     async def _get_artwork_info(self, pid: str) -> dict:
-        """获取Pixiv作品信息"""
+        """获取Pixiv作品信息，优先读取元数据缓存，同一PID的并发请求只查询一次"""
+        artwork = self.meta_cache.get(str(pid))
+        if artwork:
+            return artwork
+        return await self.single_flight.do(("info", str(pid)), lambda: self._fetch_artwork_info(pid))
+
+    async def _fetch_artwork_info(self, pid: str) -> dict:
+        """从Pixiv API查询作品信息"""
         try:
             if not self.papi:
                 logger.error("Pixiv API未初始化")
                 return None
 
             # 获取作品详情
-            for i in range(3):
-                result = self.papi.illust_detail(pid)
-                if result.illust:
-                    artwork = result.illust
-                    return {
-                        "id": artwork.id,
-                        "title": artwork.title,
-                        "user": {
-                            "id": artwork.user.id,
-                            "name": artwork.user.name
-                        },
-                        "meta_single_page": artwork.meta_single_page,
-                        "meta_pages": artwork.meta_pages,
-                        "total_view": artwork.total_view,
-                        "total_bookmarks": artwork.total_bookmarks,
-                        "sanity_level": artwork.sanity_level,
-                        "tags": artwork.tags
-                    }
-                else:
-                    logger.info("尝试重新登录Pixiv")
-                    self.papi.auth(refresh_token=self.refresh_token)
-                    await asyncio.sleep(1)
+            result = await self.papi.illust_detail(pid)
+            if result.illust:
+                return self._build_artwork_info(result.illust)
         except Exception as e:
             logger.error(f"获取作品信息失败: {e}")
         logger.info(f"未找到PID {pid} 的作品")
         return None
 
+    def _build_artwork_info(self, illust) -> dict:
+        """将API返回的作品对象转换为插件内部使用的作品信息，并写入元数据缓存"""
+        artwork = {
+            "id": illust.id,
+            "title": illust.title,
+            "user": {
+                "id": illust.user.id,
+                "name": illust.user.name
+            },
+            "meta_single_page": illust.meta_single_page,
+            "meta_pages": illust.meta_pages,
+            "image_urls": illust.image_urls,
+            "total_view": illust.total_view,
+            "total_bookmarks": illust.total_bookmarks,
+            "sanity_level": illust.sanity_level,
+            "tags": illust.tags,
+            # "create_date": illust.create_date,
+            "is_ai": hasattr(illust, 'illust_ai_type') and illust.illust_ai_type == 2
+        }
+        # 排行榜和画师作品列表中的作品信息与 illust_detail 相同，一并缓存
+        self.meta_cache.put(str(illust.id), artwork)
+        return artwork
+
     async def _download_images(self, artwork_info: dict, pid, max_num = 0) -> List[Path]:
         """下载Pixiv图片"""
         try:
@@ -261,21 +558,33 @@ class Pid2PdfPlugin(Star):
                 temp_download_dir.mkdir(parents=True, exist_ok=True)
             if artwork_info.get("meta_single_page"):
                 # 单图作品
-                url = artwork_info["meta_single_page"]["original_image_url"]
-                path = await self._download_single_image(url, 0, pid)
-                if path:
-                    image_paths.append(path)
+                urls = [artwork_info["meta_single_page"]["original_image_url"]]
             elif artwork_info.get("meta_pages"):
                 # 多图作品
-                download_num = 0
-                for i, page in enumerate(artwork_info["meta_pages"]):
-                    url = page["image_urls"]["original"]
-                    path = await self._download_single_image(url, i, pid)
-                    if path:
-                        image_paths.append(path)
-                        download_num += 1
-                    if max_num > 0 and download_num >= max_num:
-                        break
+                urls = [page["image_urls"]["original"] for page in artwork_info["meta_pages"]]
+            else:
+                urls = []
+
+            # 单个作品内的并发上限，同时受插件全局下载信号量约束
+            artwork_semaphore = asyncio.Semaphore(self.download_concurrency)
+
+            async def download(index: int, url: str):
+                async with artwork_semaphore, self.download_semaphore:
+                    return await self._download_single_image(url, index, pid)
+
+            # 按页序分批并发下载，保证结果顺序与 max_num 语义（取前 max_num 张下载成功的图片）不变
+            start = 0
+            while start < len(urls):
+                if max_num > 0:
+                    batch_size = max_num - len(image_paths)
+                else:
+                    batch_size = len(urls) - start
+                batch = urls[start:start + batch_size]
+                results = await asyncio.gather(*(download(start + i, url) for i, url in enumerate(batch)))
+                image_paths.extend(path for path in results if path)
+                start += len(batch)
+                if max_num > 0 and len(image_paths) >= max_num:
+                    break
             # logger.info(f"下载了 {len(image_paths)} 张图片")
             return image_paths
             
@@ -285,69 +594,280 @@ class Pid2PdfPlugin(Star):
 
     async def _download_single_image(self, url: str, index: int, pid, modify_hash = True) -> Path:
         """下载单张图片"""
-        for file_extension in ['jpg', 'png', 'gif']:
-            file_path = self.temp_dir / f"{pid}/image_{index}.{file_extension}"
-            if file_path.exists():
-                ## 图片已存在，无需重复下载
-                return file_path
+        file_path = self.disk_cache.lookup_page(pid, index)
+        if file_path:
+            ## 图片已存在，无需重复下载
+            return file_path
+        # 同一作品同一页的并发下载只执行一次，避免多个请求同时写同一个文件
+        return await self.single_flight.do(
+            ("image", str(pid), index),
+            lambda: self._fetch_single_image(url, index, pid, modify_hash),
+        )
+
+    async def _fetch_single_image(self, url: str, index: int, pid, modify_hash = True) -> Path:
+        """从网络下载单张图片"""
         try:
-            # 设置请求头
-            headers = {
-                'Referer': 'https://www.pixiv.net/',
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
+            result = await self._fetch_image_file(url, self.temp_dir / f"{pid}/image_{index}", modify_hash)
+            if not result:
+                return None
+            file_path, size, checksum = result
+            self.disk_cache.record_page(pid, index, file_path, size, checksum)
             
-            # 使用国内反代
-            proxy = self.proxy
-            if self.use_reverse_proxy and self.reverse_proxy:
-                url = url.replace('i.pximg.net', 'i.pixiv.re')
-                proxy = None
-            # 下载图片
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=30, proxy=proxy) as response:
-                    if response.status == 200:
-                        # # Determine file extension from content type
-                        # content_type = response.headers.get('content-type', '')
-                        # if 'jpeg' in content_type or 'jpg' in content_type:
-                        #     file_extension = 'jpg'
-                        # elif 'png' in content_type:
-                        #     file_extension = 'png'
-                        # elif 'gif' in content_type:
-                        #     file_extension = 'gif'
-                        # else:
-                        #     # Get extension from URL
-                        #     file_extension = url.split('.')[-1].split('?')[0]
-                        #     if file_extension not in ['jpg', 'jpeg', 'png', 'gif']:
-                        #         file_extension = 'jpg'  # Default to jpg
-                        
-                        # file_path = self.temp_dir / f"{pid}/image_{index}.{file_extension}"
-                        file_path = self.temp_dir / f"{pid}/image_{index}.jpg"
-                        
-                        img_data = await response.read()
-                        if modify_hash:
-                            img_data = await _image_obfus(img_data)
-                        async with aiofiles.open(file_path, 'wb') as f:
-                            await f.write(img_data)
-                        
-                        # logger.info(f"下载图片 {index}: {file_path}")
-                        return file_path
-                    else:
-                        logger.error(f"下载图片失败，状态码: {response.status}")
-                        return None
+            # logger.info(f"下载图片 {index}: {file_path}")
+            return file_path
             
         except Exception as e:
             logger.error(f"下载单张图片失败: {e}")
             return None
 
-    async def _create_pdf(self, image_paths: List[Path], pdf_name: str) -> Path:
-        """将图片转换为PDF"""
+    async def _fetch_image_file(self, url: str, stem: Path, modify_hash = True) -> tuple:
+        """
+        下载图片到 stem 加上扩展名对应的文件
+
+        Returns:
+            tuple: (文件路径, 大小, 校验值)，下载失败时返回 None
+        """
+        # 先下载到 .part 文件，中断后可以断点续传；下载时增量计算校验值
+        start_time = time.monotonic()
+        part_path = stem.with_name(f"{stem.name}.part")
+        checksum = await self._download_with_failover(url, part_path)
+        if not checksum:
+            return None
+        self.download_count += 1
+        self.download_time_total += time.monotonic() - start_time
+
+        src_path = part_path
+        result = None
+        if modify_hash:
+            # 直接对文件破坏哈希，不把图片读入事件循环的内存
+            result = await self._image_obfus(part_path, stem.with_name(f"{stem.name}.tmp"))
+        if result:
+            src_path = stem.with_name(f"{stem.name}.tmp")
+            extension, size, checksum = result["extension"], result["size"], result["checksum"]
+        else:
+            async with aiofiles.open(part_path, 'rb') as f:
+                extension = guess_extension(await f.read(16))
+            size = part_path.stat().st_size
+        # 重编码模式下统一输出 JPEG，其余模式保留原始格式；原子重命名，崩溃时不会留下残缺图片
+        file_path = stem.with_name(f"{stem.name}.{extension}")
+        os.replace(src_path, file_path)
+        part_path.unlink(missing_ok=True)
+        return file_path, size, checksum
+
+    async def _download_preview(self, artwork: dict, pid: str, quality: str) -> Path:
+        """
+        下载作品的预览图
+
+        非原图尺寸使用作品列表中 image_urls 给出的缩略图，保存为 temp/<pid>/preview_<尺寸>.jpg，
+        与作品页面分开缓存；original 或作品信息中没有对应尺寸时使用第一页原图。
+
+        Returns:
+            Path: 预览图路径，下载失败时返回 None
+        """
+        url = (artwork.get("image_urls") or {}).get(quality) if quality != QUALITY_ORIGINAL else None
+        if not url:
+            first_img = self.disk_cache.lookup_page(pid, 0)
+            if first_img:
+                return first_img
+            image_paths = await self._download_images(artwork, pid, 1)
+            return image_paths[0] if image_paths else None
+        # Pixiv 的缩略图都是 JPEG
+        preview_path = self.temp_dir / f"{pid}/preview_{quality}.jpg"
+        if self.disk_cache.lookup_file(preview_path):
+            return preview_path
+
+        async def fetch():
+            try:
+                preview_path.parent.mkdir(parents=True, exist_ok=True)
+                async with self.download_semaphore:
+                    result = await self._fetch_image_file(url, preview_path.with_suffix(""))
+                if not result:
+                    return None
+                file_path, size, checksum = result
+                self.disk_cache.record_preview(pid, file_path, size, checksum)
+                return file_path
+            except Exception as e:
+                logger.error(f"下载预览图失败: {e}")
+                return None
+
+        return await self.single_flight.do(("preview", str(pid), quality), fetch)
+
+    async def _download_with_failover(self, url: str, part_path: Path) -> str:
+        """
+        按线路优先级下载图片
+
+        每条线路内部按退避策略重试，线路失败或熔断时切换到下一条线路，并从 .part 文件已有的位置续传。
+
+        Returns:
+            str: 文件的 SHA-1 校验值，图片不存在时返回 None；所有线路都失败时抛出最后一条线路的异常
+        """
+        routes = self.mirror_selector.ranked()
+        for i, route in enumerate(routes):
+            is_last = i == len(routes) - 1
+            try:
+                checksum = await self._image_upstream(route.name).run(self._download_to_part, route, url, part_path)
+            except (CircuitOpenError, asyncio.TimeoutError, aiohttp.ClientError) as e:
+                if isinstance(e, CircuitOpenError):
+                    # 熔断的线路没有发出请求，也要计入错误率，避免错误记录过期后又被排到前面
+                    route.record(0.0, False)
+                if is_last:
+                    raise
+                logger.warning(f"线路 {route.name} 下载失败，切换到 {routes[i + 1].name}: {e}")
+                continue
+            if checksum:
+                self.mirror_selector.probe_url = url
+            # 反代可能拒绝个别请求，其他线路仍有机会下载成功
+            if checksum or is_last:
+                return checksum
+            logger.warning(f"线路 {route.name} 无法下载图片，切换到 {routes[i + 1].name}")
+
+    async def _mirror_probe_task(self):
+        """
+        定期探测每条图片线路
+
+        下载只走排在最前的线路，其余线路没有新的统计数据；这里用一个只取首字节的范围请求测量所有线路的延迟和可用性，
+        更快的镜像恢复或出现时可以被选中。
+        """
+        while True:
+            await asyncio.sleep(MIRROR_PROBE_INTERVAL)
+            url = self.mirror_selector.probe_url
+            if not url:
+                continue
+            try:
+                await asyncio.gather(*(self._probe_route(route, url) for route in self.mirror_selector.routes))
+            except Exception as e:
+                logger.error(f"探测图片线路失败: {e}")
+
+    async def _probe_route(self, route: ImageRoute, url: str) -> None:
+        start_time = time.monotonic()
+        try:
+            async with self.http_session.get(
+                route.rewrite(url), headers={'Range': 'bytes=0-0'}, timeout=MIRROR_PROBE_TIMEOUT, proxy=route.proxy
+            ) as response:
+                route.record(time.monotonic() - start_time, response.status in (200, 206))
+        except (asyncio.TimeoutError, aiohttp.ClientError):
+            route.record(time.monotonic() - start_time, False)
+
+    async def _download_to_part(self, route: ImageRoute, url: str, part_path: Path) -> str:
+        """
+        通过指定线路流式下载到 .part 文件
+
+        响应体分块直接写入磁盘并增量计算 SHA-1；已有 .part 文件时使用 HTTP Range 从已接收的位置继续下载，
+        完成后按 Content-Length 校验大小。超时、连接中断和服务端错误会抛出异常，由图床的容错策略重试并断点续传。
+        首字节延迟和请求结果记录到线路的统计中。
+
+        Returns:
+            str: 文件的 SHA-1 校验值，图片不存在等无需重试的错误返回 None
+        """
+        received = part_path.stat().st_size if part_path.exists() else 0
+        sha1 = hashlib.sha1()
+        if received:
+            # 续传时先补算已有部分的校验值
+            async with aiofiles.open(part_path, 'rb') as f:
+                while chunk := await f.read(DOWNLOAD_CHUNK_SIZE):
+                    sha1.update(chunk)
+        headers = {'Range': f'bytes={received}-'} if received else None
+        start_time = time.monotonic()
+        latency = None
+        try:
+            async with self.http_session.get(
+                route.rewrite(url), headers=headers, timeout=DOWNLOAD_TIMEOUT, proxy=route.proxy
+            ) as response:
+                latency = time.monotonic() - start_time
+                if response.status == 416:
+                    # 已接收的部分可能就是完整文件（上次在重命名前中断）
+                    _, total = _parse_content_range(response.headers.get('Content-Range'))
+                    if total is not None and received == total:
+                        route.record(latency, True)
+                        return sha1.hexdigest()
+                    part_path.unlink(missing_ok=True)
+                    raise aiohttp.ClientPayloadError(f"续传位置无效: {received} 字节")
+                if response.status == 206:
+                    start, expected_size = _parse_content_range(response.headers.get('Content-Range'))
+                    if start != received:
+                        part_path.unlink(missing_ok=True)
+                        raise aiohttp.ClientPayloadError(f"续传位置不一致: {start}/{received} 字节")
+                    mode = 'ab'
+                elif response.status == 200:
+                    # 服务器不支持 Range 时从头下载
+                    expected_size = response.content_length
+                    received = 0
+                    sha1 = hashlib.sha1()
+                    mode = 'wb'
+                elif response.status == 429 or response.status >= 500:
+                    response.raise_for_status()
+                else:
+                    logger.error(f"下载图片失败，状态码: {response.status}")
+                    route.record(latency, response.status == 404)
+                    return None
+                async with aiofiles.open(part_path, mode) as f:
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        await f.write(chunk)
+                        sha1.update(chunk)
+                        received += len(chunk)
+        except (asyncio.TimeoutError, aiohttp.ClientError):
+            # 超时、连接中断和服务端错误都计入线路的错误率
+            route.record(latency if latency is not None else time.monotonic() - start_time, False)
+            raise
+        if expected_size is not None and received != expected_size:
+            if received > expected_size:
+                part_path.unlink(missing_ok=True)
+            route.record(latency, False)
+            raise aiohttp.ClientPayloadError(f"图片大小校验失败: {received}/{expected_size} 字节")
+        route.record(latency, True)
+        return sha1.hexdigest()
+
+    def _image_upstream(self, name: str) -> Upstream:
+        """按下载线路取得对应的容错策略，每条线路独立熔断"""
+        upstream = self.upstreams.get(name)
+        if upstream is None:
+            upstream = self.upstreams[name] = Upstream(
+                name,
+                attempts=DOWNLOAD_ATTEMPTS,
+                failure_threshold=self.config.get("breaker_threshold", 5),
+                reset_timeout=self.config.get("breaker_reset_timeout", 30),
+                retry_on=(asyncio.TimeoutError, aiohttp.ClientError),
+            )
+        return upstream
+
+    async def _image_obfus(self, src_path: Path, dst_path: Path) -> dict:
+        """
+        在进程池中对图片文件破坏哈希
+
+        Returns:
+            dict: 输出文件的扩展名、大小和校验值，未处理或处理失败时返回 None
+        """
+        if self.hash_break_mode == MODE_OFF:
+            return None
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.obfus_executor, break_hash_file, str(src_path), str(dst_path), self.hash_break_mode
+            )
+        except Exception as e:
+            logger.warning(f"破坏图片哈希时发生错误: {str(e)}")
+            dst_path.unlink(missing_ok=True)
+            return None
+
+    async def _create_pdf(self, image_paths: List[Path], pdf_name: str, pdf_path: Path = None) -> Path:
+        """将图片转换为PDF，同名PDF的并发生成只执行一次"""
+        return await self.single_flight.do(
+            ("pdf", pdf_name), lambda: self._build_pdf(image_paths, pdf_name, pdf_path)
+        )
+
+    async def _build_pdf(self, image_paths: List[Path], pdf_name: str, pdf_path: Path = None) -> Path:
+        """生成PDF文件"""
         try:
             if not image_paths:
                 return None
-            pdf_path = self.persistent_dir / f"pixiv_{pdf_name}.pdf"
-            # 将图片转换为PDF
-            with open(pdf_path, 'wb') as f:
-                f.write(img2pdf.convert(image_paths))
+            pdf_path = pdf_path or self.persistent_dir / f"pixiv_{pdf_name}.pdf"
+            # 提交到PDF进程池执行，流式引擎逐页写入磁盘，不会把所有页面同时读入内存
+            # 生成期间禁止淘汰作为输入的图片目录
+            with self.disk_cache.pin(*{Path(path).parent for path in image_paths}):
+                result = await self.pdf_queue.submit(
+                    build_pdf, [str(path) for path in image_paths], str(pdf_path), self.pdf_engine
+                )
+            self.disk_cache.record_file(pdf_path, result["size"], result["checksum"])
             # logger.info(f"生成PDF: {pdf_path}")
             return pdf_path
             
@@ -369,15 +889,13 @@ class Pid2PdfPlugin(Star):
             logger.error(f"发送PDF失败: {e}")
             yield event.plain_result(f"发送PDF文件失败: {str(e)}")
 
-    async def _send_img(self, event: AstrMessageEvent, img_path: Path, pid: str, fake_record = False):
+    async def _send_img(self, event: AstrMessageEvent, image_paths: List[Path], pid: str, fake_record = False):
         """发送图片文件给用户"""
         try:
-            if img_path.exists():
+            if image_paths:
                 chain = [Plain(f'PID：{pid}')]
                 chains = [chain]
-                for img in img_path.iterdir():
-                    if not img.is_file():
-                        continue
+                for img in image_paths:
                     if len(chain) >= 10:
                         chain = []
                         chain.append(Image.fromFileSystem(str(img.absolute())))
@@ -408,9 +926,9 @@ class Pid2PdfPlugin(Star):
     async def _cleanup_temp_files(self):
         """清理临时文件"""
         try:
-            if self.temp_dir and self.temp_dir.exists():
-                import shutil
-                # shutil.rmtree(self.temp_dir)
+            if self.disk_cache:
+                await self.disk_cache.stop_sweeper()
+                self.disk_cache.sweep()
                 logger.info("清理临时文件完成")
         except Exception as e:
             logger.error(f"清理临时文件失败: {e}")
@@ -421,6 +939,11 @@ class Pid2PdfPlugin(Star):
         try:
             # 解析用户输入的参数
             message_parts = event.message_str.strip().split()
+            # 带上"原图"参数时发送原图，否则按配置的尺寸发送预览图
+            quality = None
+            if FULL_RES_KEYWORD in message_parts:
+                message_parts.remove(FULL_RES_KEYWORD)
+                quality = QUALITY_ORIGINAL
             
             # 设置默认参数
             mode = "day"  # 默认日榜
@@ -450,14 +973,14 @@ class Pid2PdfPlugin(Star):
                 else:
                     mode = "day"  # 强制使用日榜
             
-            for result in self._process_ranking_request(event, mode, date, count):
+            async for result in self._process_ranking_request(event, mode, date, count, quality):
                 yield result
 
         except Exception as e:
             logger.error(f"获取Pixiv排行榜时出错: {e}")
             yield event.plain_result(f"获取排行榜时出现错误: {str(e)}")
 
-    async def _process_ranking_request(self, event: AstrMessageEvent, mode: str, date: str, count: int):
+    async def _process_ranking_request(self, event: AstrMessageEvent, mode: str, date: str, count: int, quality: str = None):
         """Process and send Pixiv ranking request"""
         yield event.plain_result(f"正在获取Pixiv {mode} 排行榜前 {count} 个作品，请稍候...")
         
@@ -468,73 +991,102 @@ class Pid2PdfPlugin(Star):
             return
         
         # Send artwork info and images
-        async for result in self._send_ranking_results(event, ranking_data, count, mode):
+        async for result in self._send_ranking_results(event, ranking_data, count, mode, quality):
             yield result
     
     async def _get_ranking(self, mode: str = "day", date: str = None, count: int = 5) -> list:
-        """获取Pixiv排行榜数据"""
+        """获取Pixiv排行榜数据，排行榜按 (类型, 日期) 缓存并在各群之间共享"""
         try:
             if not self.papi:
                 logger.error("Pixiv API未初始化")
                 return None
             
-            # 获取排行榜
-            for i in range(3):
-                result = self.papi.illust_ranking(mode=mode, date=date)
-                if result.illusts:
-                    break
-                else:
-                    logger.info("尝试重新登录Pixiv")
-                    self.papi.auth(refresh_token=self.refresh_token)
-                    await asyncio.sleep(1)
-            if result.illusts:
-                # 应用AI过滤设置
-                ai_filter_mode = self.config.get("ai_filter_mode", "显示 AI 作品")
-                filtered_illusts = []
-                
-                for illust in result.illusts[:count * 2]:  # 获取更多以便过滤
-                    # AI作品过滤
-                    is_ai = hasattr(illust, 'illust_ai_type') and illust.illust_ai_type == 2
-                    
-                    if ai_filter_mode == "过滤 AI 作品" and is_ai:
-                        continue
-                    elif ai_filter_mode == "仅 AI 作品" and not is_ai:
-                        continue
-                    
-                    filtered_illusts.append({
-                        "id": illust.id,
-                        "title": illust.title,
-                        "user": {
-                            "id": illust.user.id,
-                            "name": illust.user.name
-                        },
-                        "meta_single_page": illust.meta_single_page,
-                        "meta_pages": illust.meta_pages,
-                        "total_view": illust.total_view,
-                        "total_bookmarks": illust.total_bookmarks,
-                        "sanity_level": illust.sanity_level,
-                        "tags": illust.tags,
-                        "is_ai": is_ai
-                    })
-                    
-                    if len(filtered_illusts) >= count:
-                        break
-                
-                return filtered_illusts[:count]
-            else:
+            entry = await self._get_ranking_entry(mode, date)
+            if not entry:
                 logger.error("排行榜数据为空")
                 return None
+            # 在缓存的完整榜单上应用AI过滤设置，不足 count 个时再按 next_url 拉取下一页
+            ai_filter_mode = self.config.get("ai_filter_mode", "显示 AI 作品")
+            filtered_illusts = []
+            index = 0
+            while len(filtered_illusts) < count:
+                if index >= len(entry["illusts"]):
+                    if not entry["next_qs"] or not await self._load_next_ranking_page(entry):
+                        break
+                    continue
+                artwork = entry["illusts"][index]
+                index += 1
+                # AI作品过滤
+                is_ai = artwork["is_ai"]
+                
+                if ai_filter_mode == "过滤 AI 作品" and is_ai:
+                    continue
+                elif ai_filter_mode == "仅 AI 作品" and not is_ai:
+                    continue
+                
+                filtered_illusts.append(artwork)
+            
+            return filtered_illusts
                 
         except Exception as e:
             logger.error(f"获取排行榜数据失败: {e}")
             return None
+
+    async def _get_ranking_entry(self, mode: str, date: str = None) -> dict:
+        """读取排行榜缓存，未命中时获取第一页"""
+        ranking_date, ttl = _ranking_cycle(date)
+        key = (mode, ranking_date)
+        entry = self.ranking_cache.get(key)
+        if entry:
+            return entry
+
+        async def fetch():
+            result = await self._fetch_ranking_page(mode=mode, date=date)
+            if not result:
+                return None
+            entry = {
+                "mode": mode,
+                "date": ranking_date,
+                "illusts": [self._build_artwork_info(illust) for illust in result.illusts],
+                "next_qs": self.papi.parse_qs(result.next_url),
+            }
+            self.ranking_cache.put(key, entry, ttl=ttl)
+            return entry
+
+        return await self.single_flight.do(("ranking", mode, ranking_date), fetch)
+
+    async def _load_next_ranking_page(self, entry: dict) -> bool:
+        """获取缓存榜单的下一页并追加到缓存中"""
+        next_qs = entry["next_qs"]
+
+        async def fetch():
+            # 其他调用方可能已经加载了这一页
+            if entry["next_qs"] is not next_qs:
+                return True
+            result = await self._fetch_ranking_page(**next_qs)
+            if not result:
+                return False
+            entry["illusts"].extend(self._build_artwork_info(illust) for illust in result.illusts)
+            entry["next_qs"] = self.papi.parse_qs(result.next_url)
+            return True
+
+        return await self.single_flight.do(
+            ("ranking_page", entry["mode"], entry["date"], str(next_qs.get("offset"))), fetch
+        )
+
+    async def _fetch_ranking_page(self, **params):
+        """调用 illust_ranking 获取一页排行榜"""
+        result = await self.papi.illust_ranking(**params)
+        if result.illusts:
+            return result
+        return None
     
-    async def _send_ranking_results(self, event: AstrMessageEvent, ranking_data: list, count: int, mode: str):
-        """发送排行榜结果"""
+    async def _send_ranking_results(self, event: AstrMessageEvent, ranking_data: list, count: int, mode: str, quality: str = None):
+        """发送排行榜结果，quality 为空时使用配置的预览图尺寸"""
         try:
-            pdf_img_paths = []
+            quality = quality or self.config.get("ranking_preview_quality", QUALITY_LARGE)
             combined_infos = ["作品信息：\n"]
-            is_r18 = mode in ["day_r18", "week_r18", "day_r18_ai"]
+            is_r18 = mode in RANKING_R18_MODES
             for i, artwork in enumerate(ranking_data, 1):
                 pid = str(artwork["id"])
                 title = artwork["title"]
@@ -554,29 +1106,18 @@ class Pid2PdfPlugin(Star):
                 if is_ai:
                     info_text += " | AI作品"
                 if is_r18:
+                    # R18 排行榜的预览图统一打包为PDF发送
                     combined_infos.append(info_text + "\n\n")
-                else:
-                    yield event.plain_result(info_text)
+                    continue
+                yield event.plain_result(info_text)
                 
-                # 下载并发送第一张图片作为预览
+                # 下载并发送预览图
                 try:
-                    # 检查本地是否已有图片
                     img_dir = self.temp_dir / f"{pid}"
-                    if img_dir.exists() and any(img_dir.iterdir()):
-                        # 发送已有的图片
-                        first_img = next(img_dir.iterdir())
-                        if is_r18:
-                            pdf_img_paths.append(str(first_img.absolute()))
-                        else:
-                            yield event.chain_result([Image.fromFileSystem(str(first_img.absolute()))])
-                    else:
-                        # 下载第一张图片
-                        image_paths = await self._download_images(artwork, pid, 1)
-                        if image_paths:
-                            if is_r18:
-                                pdf_img_paths.append(str(image_paths[0].absolute()))
-                            else:
-                                yield event.chain_result([Image.fromFileSystem(str(image_paths[0].absolute()))])
+                    with self.disk_cache.pin(img_dir):
+                        preview = await self._download_preview(artwork, pid, quality)
+                        if preview:
+                            yield event.chain_result([Image.fromFileSystem(str(preview.absolute()))])
                         else:
                             yield event.plain_result("图片下载失败")
                 except Exception as e:
@@ -586,13 +1127,14 @@ class Pid2PdfPlugin(Star):
                 # 添加分隔
                 # if i < len(ranking_data):
                 #     yield event.plain_result("---")
-            if len(pdf_img_paths) > 0:
-                pdf_name = f"{mode}_{date.today()}"
-                pdf_path = await self._create_pdf(pdf_img_paths, pdf_name)
+            if is_r18 and ranking_data:
+                ranking_date, _ = _ranking_cycle()
+                pdf_path = await self._get_ranking_pdf(mode, ranking_date, ranking_data, quality)
                 if not pdf_path:
                     yield event.plain_result(f"生成PDF失败")
                     return
-                yield event.chain_result([File(file=str(pdf_path),name=f"{pdf_name}.pdf")])
+                with self.disk_cache.pin(pdf_path):
+                    yield event.chain_result([File(file=str(pdf_path),name=f"{mode}_{ranking_date}.pdf")])
                 chain = []
                 for info in combined_infos:
                     chain.append(Plain(info))
@@ -606,14 +1148,72 @@ class Pid2PdfPlugin(Star):
             logger.error(f"发送排行榜结果失败: {e}")
             yield event.plain_result(f"发送结果时出现错误: {str(e)}")
 
+    def _ranking_pdf_path(self, mode: str, ranking_date: str, ranking_data: list, quality: str) -> Path:
+        """排行榜PDF按内容寻址：榜单类型、日期、数量、预览图尺寸、过滤设置和作品列表都相同时对应同一个文件"""
+        key = json.dumps({
+            "mode": mode,
+            "date": ranking_date,
+            "count": len(ranking_data),
+            "quality": quality,
+            "r18_mode": self.config.get("r18_mode", "过滤 R18"),
+            "ai_filter_mode": self.config.get("ai_filter_mode", "显示 AI 作品"),
+            "pids": [str(artwork["id"]) for artwork in ranking_data],
+        }, sort_keys=True)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return self.ranking_pdf_dir / f"{digest}.pdf"
+
+    async def _get_ranking_pdf(self, mode: str, ranking_date: str, ranking_data: list, quality: str = None) -> Path:
+        """获取排行榜预览PDF，已生成过的直接复用"""
+        quality = quality or self.config.get("ranking_preview_quality", QUALITY_LARGE)
+        pdf_path = self._ranking_pdf_path(mode, ranking_date, ranking_data, quality)
+        if self.disk_cache.lookup_file(pdf_path):
+            return pdf_path
+        img_dirs = [self.temp_dir / str(artwork["id"]) for artwork in ranking_data]
+        with self.disk_cache.pin(*img_dirs):
+            # 并发下载每个作品的预览图
+            results = await asyncio.gather(
+                *(self._download_preview(artwork, str(artwork["id"]), quality) for artwork in ranking_data)
+            )
+            pdf_img_paths = [path for path in results if path]
+            if len(pdf_img_paths) < len(ranking_data):
+                # 部分预览图下载失败时按实际包含的作品寻址，之后的请求不会复用这个不完整的PDF
+                included = [artwork for artwork, path in zip(ranking_data, results) if path]
+                pdf_path = self._ranking_pdf_path(mode, ranking_date, included, quality)
+            return await self._create_pdf(pdf_img_paths, pdf_path.stem, pdf_path)
+
+    async def _ranking_prebuild_task(self):
+        """排行榜更新后预先生成常用的R18排行榜PDF"""
+        while True:
+            try:
+                for mode in self.ranking_prebuild_modes:
+                    # 与简易命令使用相同的数量，保证命中同一个PDF
+                    ranking_data = await self._get_ranking(mode, None, 10)
+                    if not ranking_data:
+                        continue
+                    ranking_date, _ = _ranking_cycle()
+                    if await self._get_ranking_pdf(mode, ranking_date, ranking_data):
+                        logger.info(f"已预生成排行榜PDF: {mode}_{ranking_date}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"预生成排行榜PDF失败: {e}")
+            # 等到下次排行榜更新完成，榜单缓存也在此时过期
+            _, ttl = _ranking_cycle()
+            await asyncio.sleep(ttl + 1)
+
     @filter.command("puid")
     async def puid(self, event: AstrMessageEvent):
         """根据画师UID下载最新作品"""
         try:
             # 解析用户输入的参数
             message_parts = event.message_str.strip().split()
+            # 带上"原图"参数时发送原图，否则按配置的尺寸发送预览图
+            quality = None
+            if FULL_RES_KEYWORD in message_parts:
+                message_parts.remove(FULL_RES_KEYWORD)
+                quality = QUALITY_ORIGINAL
             if len(message_parts) < 2:
-                yield event.plain_result("请提供画师UID，格式: /puid <UID> [数量]")
+                yield event.plain_result("请提供画师UID，格式: /puid <UID> [数量] [原图]")
                 return
             
             uid = message_parts[1].strip()
@@ -649,7 +1249,7 @@ class Pid2PdfPlugin(Star):
             yield event.plain_result(f"画师: {artist_name} (UID: {uid})\n共找到 {len(works)} 个作品")
 
             # 发送画师作品
-            async for result in self._send_artist_works(event, artist_works, uid, count):
+            async for result in self._send_artist_works(event, artist_works, uid, count, quality):
                 yield result
         except Exception as e:
             logger.error(f"处理画师UID时出错: {e}")
@@ -663,14 +1263,7 @@ class Pid2PdfPlugin(Star):
                 return None
             
             # 获取画师信息
-            for i in range(3):
-                user_detail = self.papi.user_detail(uid)
-                if user_detail.user:
-                    break
-                else:
-                    logger.info("尝试重新登录Pixiv")
-                    self.papi.auth(refresh_token=self.refresh_token)
-                    await asyncio.sleep(1)
+            user_detail = await self.papi.user_detail(uid)
             if not user_detail.user:
                 logger.error(f"未找到画师 {uid}")
                 return None
@@ -679,14 +1272,7 @@ class Pid2PdfPlugin(Star):
             # logger.info(f"找到画师: {artist_name} (UID: {uid})")
             
             # 获取画师的插画作品
-            for i in range(3):
-                result = self.papi.user_illusts(uid)
-                if result.illusts is not None:
-                    break
-                else:
-                    logger.info("尝试重新登录Pixiv")
-                    self.papi.auth(refresh_token=self.refresh_token)
-                    await asyncio.sleep(1)
+            result = await self.papi.user_illusts(uid)
             if not result.illusts:
                 logger.error(f"画师 {uid} 没有作品")
                 return None
@@ -697,6 +1283,7 @@ class Pid2PdfPlugin(Star):
             
             filtered_works = []
             for illust in result.illusts:
+                artwork = self._build_artwork_info(illust)
                 # R18过滤
                 is_r18_r18g = any(tag.name in ("R-18", "R-18G") for tag in illust.tags)
                 if r18_mode == "过滤 R18" and is_r18_r18g:
@@ -705,28 +1292,13 @@ class Pid2PdfPlugin(Star):
                     continue
                 
                 # AI作品过滤
-                is_ai = hasattr(illust, 'illust_ai_type') and illust.illust_ai_type == 2
+                is_ai = artwork["is_ai"]
                 if ai_filter_mode == "过滤 AI 作品" and is_ai:
                     continue
                 elif ai_filter_mode == "仅 AI 作品" and not is_ai:
                     continue
                 
-                filtered_works.append({
-                    "id": illust.id,
-                    "title": illust.title,
-                    "user": {
-                        "id": illust.user.id,
-                        "name": illust.user.name
-                    },
-                    "meta_single_page": illust.meta_single_page,
-                    "meta_pages": illust.meta_pages,
-                    "total_view": illust.total_view,
-                    "total_bookmarks": illust.total_bookmarks,
-                    "sanity_level": illust.sanity_level,
-                    "tags": illust.tags,
-                    # "create_date": illust.create_date,
-                    "is_ai": is_ai
-                })
+                filtered_works.append(artwork)
                 
                 if len(filtered_works) >= count:
                     break
@@ -734,7 +1306,12 @@ class Pid2PdfPlugin(Star):
             return {
                 "artist_name": artist_name,
                 "artist_uid": uid,
-                "works": filtered_works[:count]
+                "works": filtered_works[:count],
+                # 未经过滤的最近作品发布时间，用于估计发帖频率
+                "post_times": [
+                    int(datetime.fromisoformat(illust.create_date).timestamp())
+                    for illust in result.illusts if illust.create_date
+                ],
             }
             
         except Exception as e:
@@ -749,14 +1326,7 @@ class Pid2PdfPlugin(Star):
                 return None
             
             # 获取画师信息
-            for i in range(3):
-                user_detail = self.papi.user_detail(uid)
-                if user_detail.user:
-                    break
-                else:
-                    logger.info("尝试重新登录Pixiv")
-                    self.papi.auth(refresh_token=self.refresh_token)
-                    await asyncio.sleep(1)
+            user_detail = await self.papi.user_detail(uid)
             if not user_detail.user:
                 logger.error(f"未找到画师 {uid}")
                 return None
@@ -765,14 +1335,7 @@ class Pid2PdfPlugin(Star):
             # logger.info(f"找到画师: {artist_name} (UID: {uid})")
             
             # 获取画师的插画作品
-            for i in range(3):
-                result = self.papi.user_illusts(uid, "manga")
-                if result.illusts is not None:
-                    break
-                # else:
-                #     logger.info("尝试重新登录Pixiv")
-                #     self.papi.auth(refresh_token=self.refresh_token)
-                #     await asyncio.sleep(1)
+            result = await self.papi.user_illusts(uid, "manga")
             if not result.illusts:
                 logger.error(f"画师 {uid} 没有作品")
                 return None
@@ -783,6 +1346,7 @@ class Pid2PdfPlugin(Star):
             
             filtered_works = []
             for illust in result.illusts:
+                artwork = self._build_artwork_info(illust)
                 # R18过滤
                 is_r18_r18g = any(tag.name in ("R-18", "R-18G") for tag in illust.tags)
                 if r18_mode == "过滤 R18" and is_r18_r18g:
@@ -791,28 +1355,13 @@ class Pid2PdfPlugin(Star):
                     continue
                 
                 # AI作品过滤
-                is_ai = hasattr(illust, 'illust_ai_type') and illust.illust_ai_type == 2
+                is_ai = artwork["is_ai"]
                 if ai_filter_mode == "过滤 AI 作品" and is_ai:
                     continue
                 elif ai_filter_mode == "仅 AI 作品" and not is_ai:
                     continue
                 
-                filtered_works.append({
-                    "id": illust.id,
-                    "title": illust.title,
-                    "user": {
-                        "id": illust.user.id,
-                        "name": illust.user.name
-                    },
-                    "meta_single_page": illust.meta_single_page,
-                    "meta_pages": illust.meta_pages,
-                    "total_view": illust.total_view,
-                    "total_bookmarks": illust.total_bookmarks,
-                    "sanity_level": illust.sanity_level,
-                    "tags": illust.tags,
-                    # "create_date": illust.create_date,
-                    "is_ai": is_ai
-                })
+                filtered_works.append(artwork)
                 
                 if len(filtered_works) >= count:
                     break
@@ -827,9 +1376,10 @@ class Pid2PdfPlugin(Star):
             logger.error(f"获取画师作品失败: {e}")
             return None
         
-    async def _send_artist_works(self, event: AstrMessageEvent, artist_data: dict, uid: str, count: int):
-        """发送画师作品结果"""
+    async def _send_artist_works(self, event: AstrMessageEvent, artist_data: dict, uid: str, count: int, quality: str = None):
+        """发送画师作品结果，quality 为空时使用配置的预览图尺寸"""
         try:
+            quality = quality or self.config.get("artist_preview_quality", QUALITY_LARGE)
             works = artist_data["works"]
             for i, artwork in enumerate(works, 1):
                 pid = str(artwork["id"])
@@ -847,19 +1397,13 @@ class Pid2PdfPlugin(Star):
                 
                 yield event.plain_result(info_text)
                 
-                # 下载并发送第一张图片作为预览
+                # 下载并发送预览图
                 try:
-                    # 检查本地是否已有图片
                     img_dir = self.temp_dir / f"{pid}"
-                    if img_dir.exists() and any(img_dir.iterdir()):
-                        # 发送已有的图片
-                        first_img = next(img_dir.iterdir())
-                        yield event.chain_result([Image.fromFileSystem(str(first_img.absolute()))])
-                    else:
-                        # 下载第一张图片
-                        image_paths = await self._download_images(artwork, pid, 1)
-                        if image_paths:
-                            yield event.chain_result([Image.fromFileSystem(str(image_paths[0].absolute()))])
+                    with self.disk_cache.pin(img_dir):
+                        preview = await self._download_preview(artwork, pid, quality)
+                        if preview:
+                            yield event.chain_result([Image.fromFileSystem(str(preview.absolute()))])
                         else:
                             yield event.plain_result("图片下载失败")
                             
@@ -922,6 +1466,19 @@ class Pid2PdfPlugin(Star):
         else:
             yield event.plain_result(f"删除订阅失败")
 
+    @filter.command("订阅列表")
+    async def list_subs(self, event: AstrMessageEvent):
+        """查看本群订阅的画师"""
+        if not self.enable_subscription:
+            yield event.plain_result("订阅功能未开启")
+            return
+        subs = self.sub_center.group_subscriptions(event.unified_msg_origin)
+        if not subs:
+            yield event.plain_result("本群暂无订阅")
+            return
+        uids = "\n".join(sub_data["user_id"] for sub_data in subs)
+        yield event.plain_result(f"本群共订阅 {len(subs)} 位画师：\n{uids}")
+
     @filter.command("刷新订阅")
     async def refresh_subscriptions(self, event: AstrMessageEvent):
         if not self.enable_subscription:
@@ -931,92 +1488,282 @@ class Pid2PdfPlugin(Star):
 
     async def _handle_sub_update(self, sub_data_list: list[SubscriptionData]):
         logger.info("开始更新订阅")
-        try:
-            for sub_data in sub_data_list:
-                user_id = sub_data["user_id"]
-                sub_groups = sub_data["sub_groups"]
-                last_updated_id = sub_data["last_updated_id"]
-                new_updated_id = int(last_updated_id)
-                last_updated_time = sub_data["last_updated_time"]
-                rand_update_interval =random.randint(86400, 172800)
-                if int(datetime.now().timestamp()) - int(last_updated_time) < rand_update_interval:
-                    # logger.info(f"画师 {user_id} 的上次作品更新距离现在不足{rand_update_interval//3600}小时，跳过本次更新")
+        start_time = time.monotonic()
+        if self.sub_feed_mode:
+            # 关注动态模式：一次翻页查询覆盖全部已关注的订阅画师
+            count = await self._handle_feed_update()
+            # 关注失败（如达到关注上限）的画师不会出现在关注动态中，在关注成功前仍然单独检查
+            unfollowed = [sub_data for sub_data in sub_data_list if not sub_data.get("followed")]
+            if unfollowed:
+                await self._run_sub_workers(unfollowed, self._refresh_artist)
+                count += len(unfollowed)
+        else:
+            count = len(sub_data_list)
+            await self._run_sub_workers(sub_data_list, self._refresh_artist)
+        self.sub_cycle_duration = time.monotonic() - start_time
+        self.sub_cycle_count += 1
+        logger.info(
+            f"订阅更新完成，共 {count} 个画师，耗时 {self.sub_cycle_duration:.1f} 秒，"
+            f"限流累计等待 {self.sub_rate_limiter.waited:.1f} 秒"
+        )
+
+    async def _run_sub_workers(self, sub_data_list: list, func):
+        """由固定数量的 worker 并行处理画师，Pixiv API 调用速率由令牌桶限制"""
+        queue = asyncio.Queue()
+        for sub_data in sub_data_list:
+            queue.put_nowait(sub_data)
+
+        async def worker():
+            while True:
+                try:
+                    sub_data = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    await func(sub_data)
+                except Exception as e:
+                    logger.error(f"更新画师 {sub_data['user_id']} 的订阅时出错： {e}")
+
+        workers = max(1, min(self.sub_workers, len(sub_data_list)))
+        await asyncio.gather(*(worker() for _ in range(workers)))
+
+    async def _refresh_artist(self, sub_data: SubscriptionData):
+        """检查单个画师的新作品并推送给订阅的群组"""
+        user_id = sub_data["user_id"]
+        sub_groups = sub_data["sub_groups"]
+        last_updated_id = sub_data["last_updated_id"]
+        new_updated_id = int(last_updated_id)
+        # 每个画师需要 user_detail 和 user_illusts 两次 API 调用
+        await self.sub_rate_limiter.acquire(2)
+        # 获取最新插图和漫画
+        for content_type in ["插画", "漫画"]:
+            artist_works = None
+            if content_type == "插画":
+                artist_works = await self._get_artist_works(user_id, 10)
+            else:
+                continue
+                artist_works = await self._get_artist_mangas(user_id, 1)
+            if not artist_works:
+                logger.error(f"无法获取画师 {user_id} 的 {content_type} 作品信息")
+                await self.sub_center.schedule_next(user_id)
+                continue
+            # 按画师最近的发帖频率安排下次检查
+            await self.sub_center.schedule_next(user_id, artist_works["post_times"])
+            artist_name = artist_works["artist_name"]
+            works = artist_works["works"] or []
+            works.sort(key=lambda x: int(x["id"]), reverse=True)
+            new_works = []
+            #单一类型的最新作品id
+            _new_updated_id_single_type = int(last_updated_id)
+            for artwork_info in works:
+                _new_updated_id_single_type = max(_new_updated_id_single_type, int(artwork_info["id"]))
+                if int(artwork_info["id"]) <= int(last_updated_id):
+                    break
+                new_works.append(artwork_info)
+            new_works = new_works[:5]
+            if new_works:
+                # 先写入推送队列再更新最后作品ID，推送完成前重启也不会漏掉作品
+                self._push_new_works(user_id, artist_name, sub_groups, new_works, content_type)
+            # 更新最后作品ID
+            if _new_updated_id_single_type > new_updated_id:
+                new_updated_id = _new_updated_id_single_type
+                await self.sub_center.renew_last_updated_id(user_id, new_updated_id)
+
+    def _push_new_works(self, user_id: str, artist_name: str, sub_groups: list, new_works: list, content_type: str):
+        """把画师的新作品写入推送队列，由后台 worker 发送给订阅的群组"""
+        self.delivery_queue.enqueue(
+            sub_groups, user_id, text=f"画师: {artist_name} (UID: {user_id})\n有 {len(new_works)} 个{content_type}新作品"
+        )
+        for artwork_info in new_works:
+            self.delivery_queue.enqueue(sub_groups, user_id, pid=str(artwork_info["id"]))
+        self.delivery_event.set()
+
+    async def _delivery_worker(self):
+        """从推送队列中取出任务发送，同一画师的任务由同一个 worker 按顺序发送"""
+        while True:
+            try:
+                jobs = self.delivery_queue.next_batch(self._delivering)
+                if not jobs:
+                    self.delivery_event.clear()
+                    # 到期的任务都在被其他 worker 处理时，等它们处理完再检查
+                    delay = self.delivery_queue.next_due_in()
+                    timeout = DELIVERY_IDLE_WAIT if not delay else min(delay, DELIVERY_IDLE_WAIT)
+                    try:
+                        await asyncio.wait_for(self.delivery_event.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
                     continue
-                await asyncio.sleep(10)
-                # 获取最新插图和漫画
-                for content_type in ["插画", "漫画"]:
-                    artist_works = None
-                    if content_type == "插画":
-                        artist_works = await self._get_artist_works(user_id, 10)
-                    else:
-                        continue
-                        artist_works = await self._get_artist_mangas(user_id, 1)
-                    if not artist_works:
-                        logger.error(f"无法获取画师 {user_id} 的 {content_type} 作品信息")
-                        continue
-                    await self.sub_center.renew_last_updated_time(user_id)
-                    artist_name = artist_works["artist_name"]
-                    works = artist_works["works"] or []
-                    works.sort(key=lambda x: int(x["id"]), reverse=True)
-                    new_works = []
-                    #单一类型的最新作品id
-                    _new_updated_id_single_type = int(last_updated_id)
-                    for artwork_info in works:
-                        _new_updated_id_single_type = max(_new_updated_id_single_type, int(artwork_info["id"]))
-                        if int(artwork_info["id"]) <= int(last_updated_id):
-                            break
-                        new_works.append(artwork_info)
-                    new_works = new_works[:5]
-                    # 更新最后作品ID
-                    if _new_updated_id_single_type > new_updated_id:
-                        new_updated_id = _new_updated_id_single_type
-                        await self.sub_center.renew_last_updated_id(user_id, new_updated_id)
-                    if len(new_works) == 0:
-                        # logger.info(f"画师 {artist_name} (UID: {user_id}) 没有符合过滤条件的 {content_type} 新作品")
-                        continue
-                    for group_id in sub_groups:
-                        await self.context.send_message(group_id, MessageChain().message(f"画师: {artist_name} (UID: {user_id})\n有 {len(new_works)} 个{content_type}新作品"))
-                    for artwork_info in new_works:
-                        await asyncio.sleep(3)
-                        #发送作品信息
-                        pid = str(artwork_info["id"])
-                        title = artwork_info["title"]
-                        is_ai = artwork_info.get("is_ai", False)
-                        is_r18_r18g = any(tag.name in ("R-18", "R-18G") for tag in artwork_info["tags"])
-                        info_text = f"#PID: {pid}\n"
-                        info_text += f"标题: {title}\n"
-                        pages = artwork_info.get("meta_pages")
-                        if pages:
-                            info_text += f"多图作品，共{len(pages)}张"
-                        if is_ai:
-                            info_text += "AI作品"
-                        for group_id in sub_groups:
-                            await self.context.send_message(group_id, MessageChain().message(info_text))
-
-                        # 下载图片
-                        image_paths = await self._download_images(artwork_info, pid, 10)
-                        if not image_paths:
-                            logger.info(f"下载PID {pid} 的图片失败")
+                user_id = jobs[0]["user_id"]
+                self._delivering.add(user_id)
+                try:
+                    await self._deliver_batch(jobs)
+                finally:
+                    self._delivering.discard(user_id)
+                    self.delivery_event.set()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"订阅推送任务异常: {e}")
+                await asyncio.sleep(DELIVERY_RETRY_DELAY)
+
+    async def _deliver_batch(self, jobs: list):
+        """发送同一画师的一批推送任务，每条消息只构建一次，并发发送给所有群组，发送成功后才从队列中删除"""
+        pids = list(dict.fromkeys(job["pid"] for job in jobs if job["pid"]))
+        pinned = [self.temp_dir / pid for pid in pids] + [self.persistent_dir / f"pixiv_{pid}.pdf" for pid in pids]
+        # 下载、发送期间禁止淘汰这些作品的图片和PDF
+        with self.disk_cache.pin(*pinned):
+            # 所有作品的图片在发送文字消息的同时开始下载
+            prepared = {pid: asyncio.ensure_future(self._prepare_artwork_push(pid)) for pid in pids}
+            try:
+                # 连续的、内容相同的任务为同一条消息发给不同群组
+                for (pid, text), group in itertools.groupby(jobs, key=lambda job: (job["pid"], job["text"])):
+                    group = list(group)
+                    sessions = [job["session"] for job in group]
+                    if pid:
+                        chains = await prepared[pid]
+                        if not chains:
+                            logger.info(f"准备PID {pid} 的推送失败，稍后重试")
+                            sent = []
                         else:
-                            img_msg_chain = MessageChain()
-                            if is_r18_r18g:
-                                # 生成PDF
-                                pdf_path = await self._create_pdf(image_paths, pid)
-                                if not pdf_path:
-                                    img_msg_chain = img_msg_chain.message("生成pdf失败")
-                                else:
-                                    img_msg_chain.chain = [File(file=str(pdf_path.absolute()), name=f"{pid}.pdf")]
-                            else:
-                                for img in image_paths:
-                                    img_msg_chain = img_msg_chain.file_image(str(img.absolute()))
-                            for group_id in sub_groups:
-                                try:
-                                    await self.context.send_message(group_id, img_msg_chain)
-                                except Exception as e:
-                                    logger.error(f"发送订阅图片失败，{e}")
-        except Exception as e:
-            logger.error(f"更新订阅时出错： {e}")
+                            info_chain, img_chain = chains
+                            sent = await self.push_dispatcher.deliver(sessions, info_chain)
+                            sent = await self.push_dispatcher.deliver(sent, img_chain)
+                    else:
+                        sent = await self.push_dispatcher.deliver(sessions, MessageChain().message(text))
+                    self.delivery_queue.ack(job["id"] for job in group if job["session"] in sent)
+                    failed = [job for job in group if job["session"] not in sent]
+                    if failed:
+                        self.delivery_queue.retry(failed, DELIVERY_RETRY_DELAY * 2 ** failed[0]["attempts"])
+            finally:
+                for task in prepared.values():
+                    task.cancel()
 
+    async def _prepare_artwork_push(self, pid: str) -> tuple:
+        """
+        下载作品并构建推送用的消息链
+
+        Returns:
+            tuple: (作品信息消息链, 图片或PDF消息链)，失败时返回 None
+        """
+        artwork_info = await self._get_artwork_info(pid)
+        if not artwork_info:
+            return None
+        #发送作品信息
+        title = artwork_info["title"]
+        is_ai = artwork_info.get("is_ai", False)
+        is_r18_r18g = any(tag.name in ("R-18", "R-18G") for tag in artwork_info["tags"])
+        info_text = f"#PID: {pid}\n"
+        info_text += f"标题: {title}\n"
+        pages = artwork_info.get("meta_pages")
+        if pages:
+            info_text += f"多图作品，共{len(pages)}张"
+        if is_ai:
+            info_text += "AI作品"
+
+        image_paths = await self._download_images(artwork_info, pid, 10)
+        if not image_paths:
+            logger.info(f"下载PID {pid} 的图片失败")
+            return None
+        img_msg_chain = MessageChain()
+        if is_r18_r18g:
+            # 生成PDF
+            pdf_path = await self._create_pdf(image_paths, pid)
+            if not pdf_path:
+                return None
+            img_msg_chain.chain = [File(file=str(pdf_path.absolute()), name=f"{pid}.pdf")]
+        else:
+            for img in image_paths:
+                img_msg_chain = img_msg_chain.file_image(str(img.absolute()))
+        return MessageChain().message(info_text), img_msg_chain
+
+    def _match_filters(self, artwork: dict) -> bool:
+        """按 R18 和 AI 过滤设置检查作品"""
+        r18_mode = self.config.get("r18_mode", "过滤 R18")
+        ai_filter_mode = self.config.get("ai_filter_mode", "显示 AI 作品")
+        is_r18_r18g = any(tag.name in ("R-18", "R-18G") for tag in artwork["tags"])
+        if r18_mode == "过滤 R18" and is_r18_r18g:
+            return False
+        elif r18_mode == "仅 R18" and not is_r18_r18g:
+            return False
+        is_ai = artwork["is_ai"]
+        if ai_filter_mode == "过滤 AI 作品" and is_ai:
+            return False
+        elif ai_filter_mode == "仅 AI 作品" and not is_ai:
+            return False
+        return True
+
+    async def _follow_subscribed_artists(self):
+        """让机器人账号关注所有尚未关注的订阅画师，使其作品出现在关注动态中"""
+        for sub_data in self.sub_center.subscriptions:
+            if sub_data.get("followed"):
+                continue
+            try:
+                await self.sub_rate_limiter.acquire()
+                result = await self.papi.pin(FEED_ACCOUNT).user_follow_add(sub_data["user_id"], restrict=FOLLOW_RESTRICT)
+                # 失败时 API 返回错误信息而不抛出异常，未关注成功的画师下一轮重试
+                message = _error_message(result)
+                if message:
+                    logger.error(f"关注画师 {sub_data['user_id']} 失败: {message}")
+                    continue
+                await self.sub_center.mark_followed(sub_data["user_id"])
+            except Exception as e:
+                logger.error(f"关注画师 {sub_data['user_id']} 失败: {e}")
+
+    async def _walk_follow_feed(self, last_id: int) -> list:
+        """
+        沿关注动态向下翻页，直到遇到已处理过的作品
+
+        Returns:
+            list: 新作品，从新到旧排列，查询失败时返回 None
+        """
+        illusts = []
+        params = {"restrict": FOLLOW_RESTRICT}
+        for _ in range(FEED_MAX_PAGES):
+            await self.sub_rate_limiter.acquire()
+            result = await self.papi.pin(FEED_ACCOUNT).illust_follow(**params)
+            if result.illusts is None:
+                logger.error("获取关注动态失败")
+                return None if not illusts else illusts
+            illusts.extend(illust for illust in result.illusts if int(illust.id) > last_id)
+            if not result.illusts or min(int(illust.id) for illust in result.illusts) <= last_id:
+                break
+            params = self.papi.parse_qs(result.next_url)
+            if not params:
+                break
+        return illusts
+
+    async def _handle_feed_update(self) -> int:
+        """
+        关注动态模式下的订阅更新，把动态中的新作品分发给各画师的订阅群组
+
+        Returns:
+            int: 有新作品的画师数量
+        """
+        await self._follow_subscribed_artists()
+        illusts = await self._walk_follow_feed(self.sub_center.feed_last_id)
+        if illusts is None:
+            return 0
+        works_by_artist = {}
+        for illust in illusts:
+            sub_data = self.sub_center.get(str(illust.user.id))
+            if sub_data and int(illust.id) > int(sub_data["last_updated_id"]):
+                works_by_artist.setdefault(str(illust.user.id), []).append(illust)
+
+        async def push(sub_data):
+            user_id = sub_data["user_id"]
+            works = sorted(works_by_artist[str(user_id)], key=lambda illust: int(illust.id), reverse=True)
+            artist_name = works[0].user.name
+            new_works = [artwork for artwork in map(self._build_artwork_info, works) if self._match_filters(artwork)]
+            new_works = new_works[:5]
+            if new_works:
+                self._push_new_works(user_id, artist_name, sub_data["sub_groups"], new_works, "插画")
+            await self.sub_center.renew_last_updated_id(user_id, int(works[0].id))
+
+        await self._run_sub_workers([self.sub_center.get(user_id) for user_id in works_by_artist], push)
+        if illusts:
+            await self.sub_center.renew_feed_last_id(max(int(illust.id) for illust in illusts))
+        await self.sub_center.defer_all(self.refresh_interval * 60)
+        return len(works_by_artist)
 
 
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
@@ -1065,8 +1812,15 @@ Pid2Pdf 插件使用说明：
 命令格式：
 /pid2pdf <Pixiv_ID> - 根据Pixiv ID下载图片并生成PDF
 /pid <Pixiv_ID> - 根据Pixiv ID下载图片并发送
-/pixiv_ranking [类型] [数量] - 获取Pixiv排行榜作品
-/puid <UID> [数量] - 根据画师UID下载最新作品
+/pixiv_ranking [类型] [数量] [原图] - 获取Pixiv排行榜作品
+/puid <UID> [数量] [原图] - 根据画师UID下载最新作品
+（排行榜和画师作品默认发送预览图，带上"原图"参数时发送原图）
+
+订阅命令（需在配置中开启订阅功能）：
+/订阅画师 <UID> - 订阅画师的新作品，推送到本群
+/删除订阅 <UID> - 取消本群对该画师的订阅
+/订阅列表 - 查看本群订阅的画师
+/刷新订阅 - 立即检查订阅画师的新作品
 
 排行榜类型：
 - day: 日榜（默认）
@@ -1087,7 +1841,7 @@ Pid2Pdf 插件使用说明：
 /pixiv_ranking week
 /pixiv_ranking 5
 /puid 12345678 3
-/puid 87654321
+/puid 87654321 原图
 
         """
         yield event.plain_result(help_text.strip())
@@ -1095,11 +1849,30 @@ Pid2Pdf 插件使用说明：
     @filter.command("pid_config")
     async def config_command(self, event: AstrMessageEvent):
         """显示当前配置状态"""
+        if self.papi and self.papi.configured_count:
+            api_status = f"{self.papi.logged_in_count}/{self.papi.configured_count} 个账号已登录"
+        else:
+            api_status = "未配置"
+        upstream_info = "，".join(
+            f"{name} {upstream.breaker.state}（重试 {upstream.retry_count} 次，拒绝 {upstream.rejected_count} 次）"
+            for name, upstream in self.upstreams.items()
+        )
         config_info = f"""
 Pid2Pdf 插件配置状态：
 
-Pixiv API状态: {'已登录' if self.papi and self.refresh_token else '未配置'}
+Pixiv API状态: {api_status}
+Pixiv账号: {len(self.papi.accounts) if self.papi else 0} 个，{self.papi.cooling_count if self.papi else 0} 个因限流冷却中
 代理设置: {self.proxy if self.proxy else '未设置'}
+API线程池: {self.papi.inflight if self.papi else 0} 个进行中，{self.papi.queue_depth if self.papi else 0} 个排队
+合并的重复请求: {self.single_flight.coalesced} 次
+作品信息缓存: {len(self.meta_cache)} 条，命中 {self.meta_cache.hits} 次，未命中 {self.meta_cache.misses} 次
+PDF队列: {self.pdf_queue.running if self.pdf_queue else 0} 个生成中，{self.pdf_queue.qsize if self.pdf_queue else 0} 个排队
+磁盘缓存: {self.disk_cache.total_size / 1024 / 1024 if self.disk_cache else 0:.1f} MB，已淘汰 {self.disk_cache.evicted_count if self.disk_cache else 0} 项
+图片下载: 共 {self.download_count} 张，平均耗时 {self.download_time_total / max(self.download_count, 1):.2f} 秒
+上游状态: {upstream_info or '无'}
+图片线路: {self.mirror_selector.summary() if self.mirror_selector else '无'}
+订阅更新: 已完成 {self.sub_cycle_count} 轮，上一轮耗时 {self.sub_cycle_duration:.1f} 秒，{self.sub_workers} 个并发
+订阅推送: 成功 {self.push_dispatcher.sent_count if self.push_dispatcher else 0} 条，失败 {self.push_dispatcher.failed_count if self.push_dispatcher else 0} 条，待推送 {len(self.delivery_queue) if self.delivery_queue else 0} 条
 
 如需配置，请在插件配置文件中设置：
 - pixiv_refresh_token: 您的Pixiv refresh_token
@@ -1109,52 +1882,27 @@ Pixiv API状态: {'已登录' if self.papi and self.refresh_token else '未配
 
     async def terminate(self):
         """插件销毁方法"""
-        await self._cleanup_temp_files()
+        # 先停止所有后台任务和进行中的下载，之后才关闭它们会用到的数据库和下载会话
+        for task in (self.prebuild_task, self.mirror_probe_task):
+            if task and not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
         await self.sub_center.cleanup()
+        for task in self.delivery_tasks:
+            task.cancel()
+        await asyncio.gather(*self.delivery_tasks, return_exceptions=True)
+        await self.single_flight.cancel_all()
+        if self.delivery_queue:
+            self.delivery_queue.close()
+        await self._cleanup_temp_files()
+        if self.cache_index:
+            self.cache_index.close()
+        if self.papi:
+            await self.papi.close()
+        if self.http_session:
+            await self.http_session.close()
+        if self.obfus_executor:
+            self.obfus_executor.shutdown(wait=False, cancel_futures=True)
+        if self.pdf_queue:
+            await self.pdf_queue.close()
         logger.info("Pid2Pdf插件已销毁")
-
-async def _image_obfus(img_data):
-    """破坏图片哈希"""
-    from PIL import Image as ImageP
-    from io import BytesIO
-    import random
-
-    try:
-        with BytesIO(img_data) as input_buffer:
-            with ImageP.open(input_buffer) as img:
-                if img.mode != "RGB":
-                    img = img.convert("RGB")
-
-                width, height = img.size
-                pixels = img.load()
-
-                points = []
-                for _ in range(3):
-                    while True:
-                        x = random.randint(0, width - 1)
-                        y = random.randint(0, height - 1)
-                        if (x, y) not in points:
-                            points.append((x, y))
-                            break
-
-                for x, y in points:
-                    r, g, b = pixels[x, y]
-
-                    r_change = random.choice([-1, 1])
-                    g_change = random.choice([-1, 1])
-                    b_change = random.choice([-1, 1])
-
-                    new_r = max(0, min(255, r + r_change))
-                    new_g = max(0, min(255, g + g_change))
-                    new_b = max(0, min(255, b + b_change))
-
-                    pixels[x, y] = (new_r, new_g, new_b)
-
-                with BytesIO() as output:
-                    img.save(output, format="JPEG", quality=95, subsampling=0)
-                    return output.getvalue()
-
-    except Exception as e:
-        logger.warning(f"破坏图片哈希时发生错误: {str(e)}")
-        return img_data
-    
\ No newline at end of file
@@ -0,0 +1,118 @@
+import statistics
+import time
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+from urllib.parse import urlparse
+
+# Pixiv 原图所在的域名
+PIXIV_IMAGE_HOST = "i.pximg.net"
+
+
+def normalize_host(address: str) -> str:
+    """把 "https://i.pixiv.re/" 之类的配置值转换为域名"""
+    address = address.strip()
+    if "://" in address:
+        return urlparse(address).netloc
+    return address.strip("/")
+
+
+class ImageRoute:
+    """
+    一条图片下载线路：直连（可经过代理）或某个反代镜像
+
+    记录最近若干次请求的首字节延迟和成败，超过 sample_ttl 的记录不再参与统计，
+    出错较多的线路过一段时间后会被重新尝试。
+    """
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        proxy: Optional[str] = None,
+        window: int = 20,
+        sample_ttl: float = 600,
+        fallback: bool = False,
+    ) -> None:
+        """
+        初始化线路
+
+        Args:
+            host: 反代镜像域名，为空表示直连 i.pximg.net
+            proxy: 请求使用的代理地址
+            window: 滑动窗口大小
+            sample_ttl: 统计记录的有效时间（秒）
+            fallback: 是否只作为兜底，排在其他健康线路之后
+        """
+        self.host = host or PIXIV_IMAGE_HOST
+        self.proxy = proxy or None
+        self.fallback = fallback
+        self.name = self.host + ("（代理）" if self.proxy else "")
+        self.sample_ttl = sample_ttl
+        # (时间, 延迟, 是否成功)
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=max(1, int(window)))
+
+    def rewrite(self, url: str) -> str:
+        """把 i.pximg.net 的图片地址改写为本线路的地址"""
+        if self.host == PIXIV_IMAGE_HOST:
+            return url
+        return url.replace(PIXIV_IMAGE_HOST, self.host, 1)
+
+    def record(self, latency: float, ok: bool) -> None:
+        self._samples.append((time.monotonic(), latency, ok))
+
+    def _recent(self) -> List[Tuple[float, float, bool]]:
+        deadline = time.monotonic() - self.sample_ttl
+        return [sample for sample in self._samples if sample[0] >= deadline]
+
+    @property
+    def error_rate(self) -> float:
+        samples = self._recent()
+        if not samples:
+            return 0.0
+        return sum(1 for _, _, ok in samples if not ok) / len(samples)
+
+    @property
+    def latency(self) -> Optional[float]:
+        """最近成功请求的首字节延迟中位数，没有记录时返回 None"""
+        latencies = [latency for _, latency, ok in self._recent() if ok]
+        if not latencies:
+            return None
+        return statistics.median(latencies)
+
+
+class MirrorSelector:
+    """
+    图片下载线路选择
+
+    健康的线路按延迟从低到高排序，还没有测量数据的线路按配置顺序排在其后，兜底线路再排在其后；
+    错误率过高的线路排在最后。下载只走排在前面的线路，其余线路的统计数据由调用方定期探测补充。
+    """
+
+    def __init__(self, routes: List[ImageRoute], max_error_rate: float = 0.5) -> None:
+        """
+        初始化线路选择
+
+        Args:
+            routes: 按配置优先级排列的线路
+            max_error_rate: 错误率超过该值的线路视为不健康
+        """
+        self.routes = routes
+        self.max_error_rate = max_error_rate
+        # 最近一次下载成功的 i.pximg.net 图片地址，用于探测各线路
+        self.probe_url: Optional[str] = None
+
+    def ranked(self) -> List[ImageRoute]:
+        """按优先级排列的线路，下载失败时依次切换"""
+        healthy = [route for route in self.routes if route.error_rate <= self.max_error_rate]
+        unhealthy = [route for route in self.routes if route.error_rate > self.max_error_rate]
+        # sort 是稳定的，延迟相同或都没有测量数据时保持配置顺序
+        healthy.sort(key=lambda route: (route.fallback, route.latency is None, route.latency or 0.0))
+        unhealthy.sort(key=lambda route: route.error_rate)
+        return healthy + unhealthy
+
+    def summary(self) -> str:
+        return "，".join(
+            f"{route.name} "
+            + (f"{route.latency * 1000:.0f}ms" if route.latency is not None else "未测量")
+            + f" 错误率 {route.error_rate:.0%}"
+            for route in self.ranked()
+        )
@@ -0,0 +1,204 @@
+"""
+PDF 生成
+
+流式写入器每次只处理一页：JPEG 原样分块拷贝进 PDF（DCTDecode），其他格式逐页解码后 Flate 压缩，
+峰值内存与单页大小相关，而不是与整本作品的大小相关。
+这里的函数会被投递到线程池或进程池中执行，因此只依赖标准库、Pillow 和 img2pdf。
+"""
+import hashlib
+import os
+import zlib
+from pathlib import Path
+from typing import BinaryIO, List, Union
+
+# 配置项中的引擎名称
+ENGINE_STREAMING = "流式"
+ENGINE_IMG2PDF = "img2pdf"
+
+# 与 img2pdf 一致：图片未声明 DPI 时按 96 DPI 计算页面尺寸
+DEFAULT_DPI = 96
+CHUNK_SIZE = 1024 * 1024
+
+
+def _fmt(value: float) -> str:
+    return f"{value:.4f}".rstrip("0").rstrip(".")
+
+
+class StreamingPdfWriter:
+    """
+    逐页写入的 PDF 生成器
+
+    每页写完后只保留对象偏移量，页面对象树和交叉引用表在 close 时写入。
+    """
+
+    def __init__(self, output: BinaryIO) -> None:
+        self._out = output
+        self._offsets: dict = {}
+        self._page_ids: List[int] = []
+        self._pos = 0
+        # 1 号对象为 Catalog，2 号对象为 Pages，在 close 时写入
+        self._next_id = 3
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data: bytes) -> None:
+        self._out.write(data)
+        self._pos += len(data)
+
+    def _alloc(self) -> int:
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _begin_obj(self, obj_id: int) -> None:
+        self._offsets[obj_id] = self._pos
+        self._write(f"{obj_id} 0 obj\n".encode("ascii"))
+
+    def _write_obj(self, obj_id: int, body: str) -> None:
+        self._begin_obj(obj_id)
+        self._write(body.encode("latin-1") + b"\nendobj\n")
+
+    def add_image(self, image_path: Union[str, Path]) -> None:
+        """把一张图片作为新的一页写入 PDF"""
+        from PIL import Image as ImageP
+
+        with ImageP.open(image_path) as img:
+            width, height = img.size
+            dpi = img.info.get("dpi") or (DEFAULT_DPI, DEFAULT_DPI)
+            dpi_x = float(dpi[0]) or DEFAULT_DPI
+            dpi_y = float(dpi[1]) or DEFAULT_DPI
+            image_id = self._alloc()
+            length_id = self._alloc()
+            if img.format == "JPEG" and img.mode in ("L", "RGB", "CMYK"):
+                length = self._write_jpeg(image_path, img, image_id, length_id, width, height)
+            else:
+                length = self._write_flate(img, image_id, length_id, width, height)
+        self._write_obj(length_id, str(length))
+
+        page_w = width * 72 / dpi_x
+        page_h = height * 72 / dpi_y
+        content = f"q\n{_fmt(page_w)} 0 0 {_fmt(page_h)} 0 0 cm\n/Im0 Do\nQ".encode("ascii")
+        content_id = self._alloc()
+        self._begin_obj(content_id)
+        self._write(f"<< /Length {len(content)} >>\nstream\n".encode("ascii") + content + b"\nendstream\nendobj\n")
+
+        page_id = self._alloc()
+        self._write_obj(
+            page_id,
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {_fmt(page_w)} {_fmt(page_h)}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>",
+        )
+        self._page_ids.append(page_id)
+
+    def _write_jpeg(self, image_path, img, image_id: int, length_id: int, width: int, height: int) -> int:
+        """JPEG 不重新编码，直接分块拷贝文件内容"""
+        colorspace = {"L": "/DeviceGray", "RGB": "/DeviceRGB", "CMYK": "/DeviceCMYK"}[img.mode]
+        decode = ""
+        if img.mode == "CMYK" and "adobe" in img.info:
+            # Adobe 生成的 CMYK JPEG 是反相存储的
+            decode = " /Decode [1 0 1 0 1 0 1 0]"
+        self._begin_obj(image_id)
+        self._write(
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace {colorspace} /BitsPerComponent 8{decode} /Filter /DCTDecode "
+            f"/Length {length_id} 0 R >>\nstream\n".encode("ascii")
+        )
+        length = 0
+        with open(image_path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self._write(chunk)
+                length += len(chunk)
+        self._write(b"\nendstream\nendobj\n")
+        return length
+
+    def _write_flate(self, img, image_id: int, length_id: int, width: int, height: int) -> int:
+        """非 JPEG 图片逐行解码并用 Flate 无损压缩"""
+        if img.mode not in ("L", "RGB"):
+            img = img.convert("RGB")
+        colorspace = "/DeviceGray" if img.mode == "L" else "/DeviceRGB"
+        self._begin_obj(image_id)
+        self._write(
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace {colorspace} /BitsPerComponent 8 /Filter /FlateDecode "
+            f"/Length {length_id} 0 R >>\nstream\n".encode("ascii")
+        )
+        compressor = zlib.compressobj(6)
+        length = 0
+        rows = max(1, CHUNK_SIZE // (width * len(img.getbands())))
+        for top in range(0, height, rows):
+            band = img.crop((0, top, width, min(top + rows, height))).tobytes()
+            data = compressor.compress(band)
+            self._write(data)
+            length += len(data)
+        data = compressor.flush()
+        self._write(data)
+        length += len(data)
+        self._write(b"\nendstream\nendobj\n")
+        return length
+
+    def close(self) -> None:
+        """写入页面树、交叉引用表和文件尾"""
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._write_obj(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>")
+        self._write_obj(1, "<< /Type /Catalog /Pages 2 0 R >>")
+        xref_pos = self._pos
+        size = self._next_id
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        for obj_id in range(1, size):
+            lines.append(f"{self._offsets[obj_id]:010d} 00000 n \n")
+        lines.append(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_pos}\n%%EOF\n")
+        self._write("".join(lines).encode("ascii"))
+
+
+class _HashingWriter:
+    """写入文件的同时计算 SHA-1，省去生成后再读一遍文件"""
+
+    def __init__(self, output: BinaryIO) -> None:
+        self._out = output
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self._out.write(data)
+        self.sha1.update(data)
+        self.size += len(data)
+
+
+def write_pdf_streaming(image_paths: List[Union[str, Path]], output: BinaryIO) -> None:
+    """逐页流式生成 PDF"""
+    writer = StreamingPdfWriter(output)
+    for image_path in image_paths:
+        writer.add_image(image_path)
+    writer.close()
+
+
+def write_pdf_img2pdf(image_paths: List[Union[str, Path]], output: BinaryIO) -> None:
+    """使用 img2pdf 一次性生成 PDF，所有页面会同时驻留内存"""
+    import img2pdf
+
+    output.write(img2pdf.convert([str(path) for path in image_paths]))
+
+
+def build_pdf(image_paths: List[Union[str, Path]], pdf_path: Union[str, Path], engine: str = ENGINE_STREAMING) -> dict:
+    """
+    生成 PDF 文件，先写入临时文件再重命名，避免其他请求读到未写完的文件
+
+    Returns:
+        dict: PDF 的路径、大小和 SHA-1 校验值
+    """
+    pdf_path = str(pdf_path)
+    tmp_path = pdf_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            output = _HashingWriter(f)
+            if engine == ENGINE_IMG2PDF:
+                write_pdf_img2pdf(image_paths, output)
+            else:
+                write_pdf_streaming(image_paths, output)
+        os.replace(tmp_path, pdf_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return {"path": pdf_path, "size": output.size, "checksum": output.sha1.hexdigest()}
@@ -0,0 +1,428 @@
+import asyncio
+import functools
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+from astrbot.api import logger
+
+from .concurrency import TokenBucket
+from .resilience import Upstream
+
+
+class _PixivMethods(ABC):
+    """插件用到的 AppPixivAPI 方法，子类实现 call"""
+
+    @abstractmethod
+    async def call(self, method: str, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """执行 AppPixivAPI 的同名方法"""
+
+    async def illust_detail(self, illust_id) -> Any:
+        return await self.call("illust_detail", illust_id)
+
+    async def illust_ranking(self, mode: str = "day", date: Optional[str] = None, **kwargs) -> Any:
+        return await self.call("illust_ranking", mode=mode, date=date, **kwargs)
+
+    async def user_detail(self, user_id) -> Any:
+        return await self.call("user_detail", user_id)
+
+    async def user_illusts(self, user_id, type: str = "illust", **kwargs) -> Any:
+        return await self.call("user_illusts", user_id, type, **kwargs)
+
+    async def illust_follow(self, restrict: str = "public", **kwargs) -> Any:
+        return await self.call("illust_follow", restrict=restrict, **kwargs)
+
+    async def user_follow_add(self, user_id, restrict: str = "public") -> Any:
+        return await self.call("user_follow_add", user_id, restrict=restrict)
+
+
+class AsyncPixivAPI(_PixivMethods):
+    """
+    AppPixivAPI 的异步封装
+
+    pixivpy3 基于同步的 requests 实现，直接在协程里调用会阻塞整个事件循环。
+    这里把所有调用投递到一个独立的、大小受限的线程池中执行，并为每次调用设置超时。
+    """
+
+    def __init__(self, papi, max_workers: int = 4, timeout: float = 30) -> None:
+        """
+        初始化异步封装
+
+        Args:
+            papi: AppPixivAPI 实例
+            max_workers: 线程池大小，即同时进行的 Pixiv 请求上限
+            timeout: 单次调用的默认超时时间（秒）
+        """
+        self.papi = papi
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pixiv_api")
+        self._counter_lock = threading.Lock()
+        self._inflight = 0
+        self.total_calls = 0
+        self.timeout_calls = 0
+        # 设置后每次调用前都会确认登录令牌有效
+        self.token_manager: Optional["TokenManager"] = None
+
+    @property
+    def inflight(self) -> int:
+        """已提交但尚未执行完毕的调用数（包括正在执行和排队中的）"""
+        return self._inflight
+
+    @property
+    def queue_depth(self) -> int:
+        """在线程池中排队等待执行的调用数"""
+        return max(0, self._inflight - self.max_workers)
+
+    def _on_done(self, _future) -> None:
+        with self._counter_lock:
+            self._inflight -= 1
+
+    async def call(self, method: str, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        在线程池中执行 AppPixivAPI 的任意方法
+
+        Args:
+            method: AppPixivAPI 的方法名
+            timeout: 本次调用的超时时间（秒），为空时使用默认值
+
+        Returns:
+            Any: 原方法的返回值
+        """
+        if self.token_manager and method != "auth":
+            await self.token_manager.ensure_valid()
+        func = functools.partial(getattr(self.papi, method), *args, **kwargs)
+        with self._counter_lock:
+            self._inflight += 1
+            self.total_calls += 1
+        # 计数在线程真正结束时才减少，超时后仍在运行的请求依然占用线程
+        cf = self._executor.submit(func)
+        cf.add_done_callback(self._on_done)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(cf), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.timeout_calls += 1
+            logger.warning(f"Pixiv API 调用 {method} 超时，当前排队数: {self.queue_depth}")
+            raise
+
+    async def auth(self, refresh_token: str) -> Any:
+        return await self.call("auth", refresh_token=refresh_token)
+
+    def parse_qs(self, next_url: Optional[str]) -> Optional[dict]:
+        """解析翻页用的 next_url，不发起网络请求"""
+        if not next_url:
+            return None
+        return self.papi.parse_qs(next_url)
+
+    def shutdown(self) -> None:
+        """关闭线程池，不等待仍在执行的请求"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class TokenManager:
+    """
+    Pixiv 登录令牌管理
+
+    根据 auth 响应中的 expires_in 记录令牌过期时间，由后台任务在过期前提前刷新，请求不需要等待登录。
+    所有刷新都在同一把锁内串行执行；多个请求同时发现令牌失效时，只有第一个会真正重新登录。
+    """
+
+    def __init__(self, api: AsyncPixivAPI, refresh_token: str, refresh_margin: float = 300, retry_delay: float = 30) -> None:
+        """
+        初始化令牌管理
+
+        Args:
+            api: Pixiv API 异步封装
+            refresh_token: Pixiv refresh_token
+            refresh_margin: 提前多久刷新令牌（秒）
+            retry_delay: 刷新失败后的重试间隔（秒），期间请求不再尝试登录
+        """
+        self.api = api
+        self.refresh_token = refresh_token
+        self.refresh_margin = refresh_margin
+        self.retry_delay = retry_delay
+        self.expires_at = 0.0
+        # 每次成功刷新后加一，用于判断令牌是否已被其他请求刷新过
+        self.generation = 0
+        self.refresh_count = 0
+        # 上次刷新失败的时间，0 表示上次刷新成功
+        self.failed_at = 0.0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def expires_in(self) -> float:
+        """令牌剩余有效时间（秒）"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    async def refresh(self, generation: Optional[int] = None) -> bool:
+        """
+        重新登录获取新令牌
+
+        Args:
+            generation: 调用方发现令牌失效时看到的令牌版本，令牌已被其他调用方刷新过时直接返回；
+                最近 retry_delay 秒内刚刷新失败过时也直接返回，不重复登录
+
+        Returns:
+            bool: 令牌是否可用
+        """
+        async with self._lock:
+            if generation is not None:
+                if generation != self.generation:
+                    return True
+                if self.in_backoff:
+                    return False
+            try:
+                token = await self.api.auth(refresh_token=self.refresh_token)
+            except Exception as e:
+                self.failed_at = time.monotonic()
+                logger.error(f"Pixiv API登录失败: {e}")
+                return False
+            self.failed_at = 0.0
+            response = getattr(token, "response", None)
+            self.expires_at = time.monotonic() + (getattr(response, "expires_in", None) or 3600)
+            # Pixiv 可能会轮换 refresh_token，之后使用新的
+            self.refresh_token = getattr(response, "refresh_token", None) or self.refresh_token
+            self.generation += 1
+            self.refresh_count += 1
+            logger.info(f"Pixiv 登录令牌已刷新，有效期 {self.expires_in / 60:.0f} 分钟")
+            return True
+
+    @property
+    def in_backoff(self) -> bool:
+        """上次刷新失败且还没到重试时间"""
+        return bool(self.failed_at) and time.monotonic() - self.failed_at < self.retry_delay
+
+    async def ensure_valid(self) -> None:
+        """令牌已过期时（如后台刷新失败）才在请求中同步刷新，刷新失败后的重试间隔内不再尝试"""
+        if self.expires_at <= time.monotonic() and not self.in_backoff:
+            await self.refresh(self.generation)
+
+    async def _refresher(self) -> None:
+        while True:
+            try:
+                await asyncio.sleep(max(0.0, self.expires_in - self.refresh_margin))
+                if not await self.refresh(self.generation):
+                    await asyncio.sleep(self.retry_delay)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"刷新登录令牌任务异常: {e}")
+                await asyncio.sleep(self.retry_delay)
+
+    def start(self) -> None:
+        """启动后台刷新任务"""
+        if not self._task:
+            self._task = asyncio.create_task(self._refresher())
+
+    async def stop(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+
+def _error_message(result: Any) -> str:
+    """取出 API 返回的错误信息，没有错误时返回空字符串"""
+    error = result.get("error") if isinstance(result, dict) else None
+    if not error:
+        return ""
+    if isinstance(error, dict):
+        return str(error.get("message") or error.get("user_message") or error)
+    return str(error)
+
+
+def _is_rate_limited(message: str) -> bool:
+    """Pixiv 的错误响应是否为限流（错误信息为 "Rate Limit"）"""
+    return "rate limit" in message.lower()
+
+
+def _is_rate_limited_error(error: Exception) -> bool:
+    """
+    异常是否来自 HTTP 429 响应
+
+    只看响应状态码，不匹配异常文本：网络错误的信息中带有请求 URL，作品ID等参数可能恰好包含 "429"。
+    """
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+
+class PixivAccount:
+    """
+    账号池中的一个 Pixiv 账号
+
+    每个账号有独立的 API 客户端、线程池、登录令牌和限流令牌桶。
+    """
+
+    def __init__(self, api: AsyncPixivAPI, refresh_token: str, rate: float = 2, burst: int = 5) -> None:
+        """
+        初始化账号
+
+        Args:
+            api: 该账号的 API 异步封装
+            refresh_token: 该账号的 refresh_token，为空时不登录
+            rate: 该账号每秒最多发起的调用数，小于等于 0 时不限流
+            burst: 该账号允许连续发起的调用数
+        """
+        self.api = api
+        self.token_manager = TokenManager(api, refresh_token) if refresh_token else None
+        api.token_manager = self.token_manager
+        self.bucket = TokenBucket(rate, burst)
+        self.cooldown_until = 0.0
+        self.calls = 0
+        self.rate_limited_count = 0
+
+    @property
+    def cooling_down(self) -> bool:
+        return self.cooldown_until > time.monotonic()
+
+
+class AccountPool(_PixivMethods):
+    """
+    Pixiv 账号池
+
+    每次调用路由到未处于冷却中、进行中请求最少的账号，并受该账号的令牌桶限流。
+    账号被限流时自动冷却一段时间，调用改由其他账号重试；令牌失效时只刷新该账号的令牌。
+    """
+
+    def __init__(self, accounts: List[PixivAccount], cooldown: float = 300, upstream: Optional[Upstream] = None) -> None:
+        """
+        初始化账号池
+
+        Args:
+            accounts: 账号列表，至少一个
+            cooldown: 账号被限流后的冷却时间（秒）
+            upstream: Pixiv API 的重试与熔断策略，为空时失败不重试
+        """
+        if not accounts:
+            raise ValueError("账号池至少需要一个账号")
+        self.accounts = accounts
+        self.cooldown = cooldown
+        self.upstream = upstream
+
+    @property
+    def inflight(self) -> int:
+        return sum(account.api.inflight for account in self.accounts)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(account.api.queue_depth for account in self.accounts)
+
+    @property
+    def configured_count(self) -> int:
+        """配置了 refresh_token 的账号数"""
+        return sum(1 for account in self.accounts if account.token_manager)
+
+    @property
+    def logged_in_count(self) -> int:
+        """令牌仍在有效期内的账号数"""
+        return sum(1 for account in self.accounts if account.token_manager and account.token_manager.expires_in > 0)
+
+    @property
+    def cooling_count(self) -> int:
+        """冷却中的账号数"""
+        return sum(1 for account in self.accounts if account.cooling_down)
+
+    async def login(self) -> int:
+        """
+        所有账号登录并启动后台令牌刷新
+
+        Returns:
+            int: 登录成功的账号数
+        """
+        managers = [account.token_manager for account in self.accounts if account.token_manager]
+        results = await asyncio.gather(*(manager.refresh() for manager in managers))
+        for manager in managers:
+            manager.start()
+        return sum(1 for ok in results if ok)
+
+    def pin(self, index: int = 0) -> "_PinnedAccount":
+        """
+        固定使用某一个账号的调用入口
+
+        关注、关注动态等与账号状态相关的调用必须始终由同一个账号执行。
+        """
+        return _PinnedAccount(self, index)
+
+    def _pick(self, exclude: set) -> PixivAccount:
+        candidates = [account for account in self.accounts if id(account) not in exclude] or self.accounts
+        available = [account for account in candidates if not account.cooling_down]
+        if not available:
+            # 全部在冷却中时选最早结束冷却的
+            return min(candidates, key=lambda account: account.cooldown_until)
+        return min(available, key=lambda account: (account.api.inflight, account.calls))
+
+    async def call(self, method: str, *args, timeout: Optional[float] = None, pinned: Optional[int] = None, **kwargs) -> Any:
+        """
+        选择一个账号执行 AppPixivAPI 的方法，超时或网络错误时按容错策略重试
+
+        Args:
+            pinned: 指定账号序号时只使用该账号，被限流时不改由其他账号重试
+
+        Returns:
+            Any: 原方法的返回值
+        """
+        if self.upstream:
+            return await self.upstream.run(self._call, method, *args, timeout=timeout, pinned=pinned, **kwargs)
+        return await self._call(method, *args, timeout=timeout, pinned=pinned, **kwargs)
+
+    async def _call(self, method: str, *args, timeout: Optional[float] = None, pinned: Optional[int] = None, **kwargs) -> Any:
+        tried = set()
+        result = None
+        for _ in range(len(self.accounts) if pinned is None else 1):
+            account = self._pick(tried) if pinned is None else self.accounts[pinned]
+            tried.add(id(account))
+            await account.bucket.acquire()
+            account.calls += 1
+            generation = account.token_manager.generation if account.token_manager else 0
+            try:
+                result = await account.api.call(method, *args, timeout=timeout, **kwargs)
+            except Exception as e:
+                if not _is_rate_limited_error(e):
+                    raise
+                self._cool_down(account, str(e))
+                if pinned is not None:
+                    raise
+                continue
+            message = _error_message(result)
+            if message and _is_rate_limited(message):
+                self._cool_down(account, message)
+                continue
+            if message and "oauth" in message.lower() and account.token_manager:
+                # 令牌失效，刷新该账号的令牌后重试一次
+                if await account.token_manager.refresh(generation):
+                    result = await account.api.call(method, *args, timeout=timeout, **kwargs)
+            return result
+        return result
+
+    def _cool_down(self, account: PixivAccount, message: str) -> None:
+        account.cooldown_until = time.monotonic() + self.cooldown
+        account.rate_limited_count += 1
+        logger.warning(f"Pixiv 账号 {self.accounts.index(account) + 1} 被限流，冷却 {self.cooldown:.0f} 秒: {message}")
+
+    def parse_qs(self, next_url: Optional[str]) -> Optional[dict]:
+        """解析翻页用的 next_url，不发起网络请求"""
+        return self.accounts[0].api.parse_qs(next_url)
+
+    async def close(self) -> None:
+        """停止令牌刷新并关闭所有账号的线程池"""
+        for account in self.accounts:
+            if account.token_manager:
+                await account.token_manager.stop()
+            account.api.shutdown()
+
+
+class _PinnedAccount(_PixivMethods):
+    """账号池中固定使用某一个账号的调用入口，仍然经过账号池的限流、令牌刷新和容错策略"""
+
+    def __init__(self, pool: AccountPool, index: int) -> None:
+        self.pool = pool
+        self.index = index
+
+    async def call(self, method: str, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        return await self.pool.call(method, *args, timeout=timeout, pinned=self.index, **kwargs)
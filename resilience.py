@@ -0,0 +1,157 @@
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, Tuple, Type
+
+from astrbot.api import logger
+
+# 熔断器状态
+STATE_CLOSED = "正常"
+STATE_OPEN = "熔断"
+STATE_HALF_OPEN = "试探"
+
+
+class CircuitOpenError(Exception):
+    """上游处于熔断状态，请求被直接拒绝"""
+
+
+class RetryBudget:
+    """
+    重试预算
+
+    每次请求存入 ratio 个令牌，每次重试消耗一个，最多积攒 max_tokens 个。
+    上游整体故障时，重试次数被限制在请求数的一定比例以内，不会因为重试成倍放大负载。
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10) -> None:
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """取出一次重试的额度，预算耗尽时返回 False"""
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续失败达到阈值后熔断，熔断期间请求直接失败；每隔 reset_timeout 秒放行一个试探请求，成功后恢复。
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30) -> None:
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.is_open = False
+
+    @property
+    def state(self) -> str:
+        if not self.is_open:
+            return STATE_CLOSED
+        if time.monotonic() >= self.opened_at + self.reset_timeout:
+            return STATE_HALF_OPEN
+        return STATE_OPEN
+
+    def allow(self) -> bool:
+        """判断是否放行请求，熔断中每个 reset_timeout 周期只放行一个试探请求"""
+        state = self.state
+        if state == STATE_CLOSED:
+            return True
+        if state == STATE_HALF_OPEN:
+            # 推迟下一次试探，试探结果返回前的其他请求仍然直接失败
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.is_open = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.is_open or self.failures >= self.failure_threshold:
+            self.is_open = True
+            self.opened_at = time.monotonic()
+
+
+class Upstream:
+    """
+    一个上游服务的容错策略
+
+    失败时按指数退避加随机抖动重试，重试受预算限制；连续失败后熔断，熔断期间请求快速失败。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        attempts: int = 3,
+        base_delay: float = 1,
+        max_delay: float = 30,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+    ) -> None:
+        """
+        初始化上游
+
+        Args:
+            name: 上游名称，用于日志
+            attempts: 单次请求的最大尝试次数
+            base_delay: 首次重试的退避上限（秒），之后每次翻倍
+            max_delay: 退避时间上限（秒）
+            failure_threshold: 连续失败多少次后熔断
+            reset_timeout: 熔断后多久放行试探请求（秒）
+            retry_on: 视为上游故障、需要重试的异常类型
+        """
+        self.name = name
+        self.attempts = max(1, int(attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.budget = RetryBudget()
+        self.retry_count = 0
+        self.rejected_count = 0
+
+    def _backoff(self, attempt: int) -> float:
+        # full jitter：在 [0, base * 2^attempt] 内随机取值，避免大量请求同时重试
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def run(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        执行一次请求，失败时按策略重试
+
+        Raises:
+            CircuitOpenError: 上游处于熔断状态
+        """
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.rejected_count += 1
+                raise CircuitOpenError(f"{self.name} 熔断中，请求被拒绝")
+            try:
+                result = await func(*args, **kwargs)
+            except CircuitOpenError:
+                raise
+            except self.retry_on as e:
+                self.breaker.record_failure()
+                attempt += 1
+                if attempt >= self.attempts or not self.budget.withdraw():
+                    raise
+                delay = self._backoff(attempt)
+                self.retry_count += 1
+                logger.warning(f"请求 {self.name} 失败，{delay:.1f} 秒后第 {attempt} 次重试: {e}")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
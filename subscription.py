@@ -1,11 +1,23 @@
 import asyncio
+import heapq
 import json
+import os
+import random
+import statistics
 from astrbot.api import logger
-from typing import Callable, Any, Optional, TypedDict, List
+from typing import Callable, Any, Dict, Optional, Set, TypedDict, List, Tuple
 from pathlib import Path
 import aiofiles
 from datetime import datetime
 
+# 自适应轮询：轮询间隔为发帖间隔的 1/POLL_FRACTION，并加入随机抖动分散请求
+POLL_FRACTION = 4
+POLL_JITTER = 0.1
+# 刷新任务两次检查之间的最短等待时间（秒）
+MIN_TICK = 60
+# 订阅数据修改后延迟写盘的时间（秒），期间的多次修改合并为一次写入
+SAVE_DELAY = 5
+
 
 class SubscriptionData(TypedDict):
     """
@@ -16,11 +28,19 @@ class SubscriptionData(TypedDict):
     last_updated_id: str
     last_updated_time: int
     sub_groups: List[str]
+    # 估计的发帖间隔（秒），0 表示尚无数据
+    post_interval: int
+    # 下次检查的时间戳
+    next_check_time: int
+    # 机器人账号是否已关注该画师（关注动态模式使用）
+    followed: bool
 
 
 class SubscriptionCenter:
     """
     订阅中心类，用于管理订阅对象和定时刷新
+
+    订阅数据按画师ID和群组建立索引，增删改都只在内存中进行，之后延迟批量写盘。
     """
 
     def __init__(
@@ -28,26 +48,56 @@ class SubscriptionCenter:
         storage_file: str = "subscriptions.json",
         refresh_interval: int = 3600 * 5,
         max_update_count: int = 5,
+        min_poll_interval: int = 3600,
+        max_poll_interval: int = 86400 * 7,
     ) -> None:
         """
         初始化订阅中心
 
         Args:
             storage_file: 订阅数据存储文件路径
-            refresh_interval: 定时刷新间隔（秒）
+            refresh_interval: 定时刷新间隔（秒），即两次检查到期画师之间的最长等待时间
+            min_poll_interval: 单个画师的最短轮询间隔（秒）
+            max_poll_interval: 单个画师的最长轮询间隔（秒）
         """
         self.storage_file = Path(storage_file)
         self.max_update_count = max_update_count
         self.refresh_interval = refresh_interval
-        self.subscriptions: List[SubscriptionData] = []
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max(min_poll_interval, max_poll_interval)
+        # 下次检查时间的最小堆 (next_check_time, user_id)，过期的条目在弹出时跳过
+        self._schedule: List[Tuple[int, str]] = []
+        # 关注动态中已处理过的最新作品ID
+        self.feed_last_id = 0
+        # 画师ID -> 订阅对象，群组 -> 订阅的画师ID集合
+        self._by_user: Dict[str, SubscriptionData] = {}
+        self._by_group: Dict[str, Set[str]] = {}
+        # 画师ID -> 连续检查失败次数，只保存在内存中
+        self._failures: Dict[str, int] = {}
+        self._save_task: Optional[asyncio.Task] = None
         self.callback: Optional[Callable[[List[SubscriptionData]], Any]] = None
         self._timer_task: Optional[asyncio.Task] = None
         self._is_running = False
+        # 保证同一时间只有一次写盘
         self._lock = asyncio.Lock()
 
     async def initilize(self):
         await self._load_subscriptions()
 
+    @property
+    def subscriptions(self) -> List[SubscriptionData]:
+        """全部订阅对象"""
+        return list(self._by_user.values())
+
+    def _index(self, sub_data: SubscriptionData) -> None:
+        self._by_user[sub_data["user_id"]] = sub_data
+        for group_id in sub_data["sub_groups"]:
+            self._by_group.setdefault(group_id, set()).add(sub_data["user_id"])
+
+    def group_subscriptions(self, group_id: str) -> List[SubscriptionData]:
+        """查询群组订阅的所有画师"""
+        return [self._by_user[sub_id] for sub_id in self._by_group.get(group_id, ())]
+
     async def _load_subscriptions(self) -> None:
         """
         从本地文件加载订阅数据
@@ -58,15 +108,21 @@ class SubscriptionCenter:
                     content = await f.read()
                     if content.strip():
                         data = json.loads(content)
-                        self.subscriptions = []
+                        self.feed_last_id = int(data.get("feed_last_id", 0))
+                        self._by_user.clear()
+                        self._by_group.clear()
                         for sub in data.get("subscriptions", []):
-                            self.subscriptions.append(SubscriptionData(
-                                user_id=sub.get("user_id", ""),
+                            self._index(SubscriptionData(
+                                user_id=str(sub.get("user_id", "")),
                                 last_updated_id=sub.get("last_updated_id", "0"),
                                 last_updated_time=sub.get("last_updated_time", 0),
-                                sub_groups=sub.get("sub_groups", [])
+                                sub_groups=sub.get("sub_groups", []),
+                                post_interval=sub.get("post_interval", 0),
+                                next_check_time=sub.get("next_check_time", 0),
+                                followed=sub.get("followed", False),
                             ))
-                        logger.info(f"成功加载 {len(self.subscriptions)} 个订阅对象")
+                        self._rebuild_schedule()
+                        logger.info(f"成功加载 {len(self._by_user)} 个订阅对象")
             else:
                 logger.info("订阅存储文件不存在，将创建新文件")
         except json.JSONDecodeError as e:
@@ -77,18 +133,42 @@ class SubscriptionCenter:
     async def _save_subscriptions(self) -> None:
         """
         保存订阅数据到本地文件
+
+        先写入临时文件再重命名，写入过程中崩溃不会损坏原有的订阅数据。
         """
         try:
-            data = {
-                "subscriptions": self.subscriptions,
-                "last_updated": datetime.now().isoformat()
-            }
-            async with aiofiles.open(self.storage_file, "w", encoding="utf-8") as f:
-                await f.write(json.dumps(data, indent=2, ensure_ascii=False))
+            async with self._lock:
+                data = {
+                    "subscriptions": self.subscriptions,
+                    "feed_last_id": self.feed_last_id,
+                    "last_updated": datetime.now().isoformat()
+                }
+                tmp_file = self.storage_file.with_name(self.storage_file.name + ".tmp")
+                async with aiofiles.open(tmp_file, "w", encoding="utf-8") as f:
+                    await f.write(json.dumps(data, ensure_ascii=False))
+                os.replace(tmp_file, self.storage_file)
             logger.debug("订阅数据已保存")
         except Exception as e:
             logger.error(f"保存订阅数据失败: {e}")
 
+    def _schedule_save(self) -> None:
+        """延迟保存订阅数据，SAVE_DELAY 秒内的多次修改只写一次文件"""
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._delayed_save())
+
+    async def _delayed_save(self) -> None:
+        await asyncio.sleep(SAVE_DELAY)
+        # 先清空任务引用，保存期间发生的修改会安排新的一次保存
+        self._save_task = None
+        await self._save_subscriptions()
+
+    async def flush(self) -> None:
+        """立即保存尚未写盘的修改"""
+        if self._save_task and not self._save_task.done():
+            self._save_task.cancel()
+            self._save_task = None
+            await self._save_subscriptions()
+
     async def add_subscription(self, sub_id: int, group_id: str) -> bool:
         """
         增加订阅
@@ -100,22 +180,20 @@ class SubscriptionCenter:
             bool: 操作是否成功
         """
         try:
-            async with self._lock:
-                is_new_sub = True
-                for sub_data in self.subscriptions:
-                    if sub_data["user_id"] == sub_id:
-                        if group_id not in sub_data["sub_groups"]:
-                            sub_data["sub_groups"].append(group_id)
-                        is_new_sub = False
-                        break
-                if is_new_sub:
-                    self.subscriptions.append(
-                        SubscriptionData(
-                            user_id=sub_id, last_updated_id=0, last_updated_time=0, sub_groups=[group_id]
-                        )
-                    )
-                logger.info(f"成功添加订阅对象: {sub_id}，群组：{group_id}")
-                await self._save_subscriptions()
+            sub_id = str(sub_id)
+            sub_data = self._by_user.get(sub_id)
+            if sub_data:
+                if group_id not in sub_data["sub_groups"]:
+                    sub_data["sub_groups"].append(group_id)
+            else:
+                sub_data = SubscriptionData(
+                    user_id=sub_id, last_updated_id="0", last_updated_time=0, sub_groups=[group_id],
+                    post_interval=0, next_check_time=0, followed=False,
+                )
+                heapq.heappush(self._schedule, (0, sub_id))
+            self._index(sub_data)
+            logger.info(f"成功添加订阅对象: {sub_id}，群组：{group_id}")
+            self._schedule_save()
             return True
         except Exception as e:
             logger.error(f"添加订阅失败: {e}")
@@ -133,21 +211,153 @@ class SubscriptionCenter:
             bool: 操作是否成功
         """
         try:
-            async with self._lock:
-                for sub_data in self.subscriptions:
-                    if sub_data["user_id"] == sub_id:
-                        if group_id in sub_data["sub_groups"]:
-                            sub_data["sub_groups"].remove(group_id)
-                        if len(sub_data["sub_groups"]) == 0:
-                            self.subscriptions.remove(sub_data)
-                        break
-                logger.info(f"成功删除订阅")
-                await self._save_subscriptions()
+            sub_id = str(sub_id)
+            sub_data = self._by_user.get(sub_id)
+            if sub_data:
+                if group_id in sub_data["sub_groups"]:
+                    sub_data["sub_groups"].remove(group_id)
+                group_subs = self._by_group.get(group_id)
+                if group_subs:
+                    group_subs.discard(sub_id)
+                    if not group_subs:
+                        del self._by_group[group_id]
+                if len(sub_data["sub_groups"]) == 0:
+                    del self._by_user[sub_id]
+                    self._failures.pop(sub_id, None)
+            logger.info(f"成功删除订阅")
+            self._schedule_save()
             return True
         except Exception as e:
             logger.error(f"删除订阅失败: {e}")
             return False
 
+    def _rebuild_schedule(self) -> None:
+        self._schedule = [(int(sub["next_check_time"]), sub["user_id"]) for sub in self._by_user.values()]
+        heapq.heapify(self._schedule)
+
+    def _find(self, sub_id: str) -> Optional[SubscriptionData]:
+        return self._by_user.get(str(sub_id))
+
+    def get(self, sub_id: str) -> Optional[SubscriptionData]:
+        """按画师ID查询订阅对象"""
+        return self._find(sub_id)
+
+    def pop_due(self, now: Optional[int] = None) -> List[SubscriptionData]:
+        """
+        取出所有已到检查时间的订阅对象
+
+        取出的订阅对象需要调用 schedule_next 重新排期，否则不会再被检查。
+
+        Returns:
+            List[SubscriptionData]: 到期的订阅对象
+        """
+        now = int(datetime.now().timestamp()) if now is None else now
+        due = []
+        while self._schedule and self._schedule[0][0] <= now:
+            next_check_time, sub_id = heapq.heappop(self._schedule)
+            sub_data = self._find(sub_id)
+            # 跳过已取消的订阅和被重新排期后留下的旧条目
+            if sub_data and int(sub_data["next_check_time"]) == next_check_time:
+                due.append(sub_data)
+        return due
+
+    def next_due_in(self) -> Optional[float]:
+        """距离最早一次到期检查的秒数，没有订阅时返回 None"""
+        if not self._schedule:
+            return None
+        return self._schedule[0][0] - datetime.now().timestamp()
+
+    def _estimate_post_interval(self, post_times: List[int]) -> int:
+        """用最近作品发布时间的间隔中位数估计发帖频率"""
+        post_times = sorted(set(post_times), reverse=True)
+        gaps = [newer - older for newer, older in zip(post_times, post_times[1:])]
+        if not gaps:
+            return 0
+        return int(statistics.median(gaps))
+
+    def _poll_interval(self, sub_data: SubscriptionData, latest_post: Optional[int], now: int) -> int:
+        """
+        根据发帖频率计算下次检查的间隔
+
+        长时间没有发帖的画师按距离上次发帖的时长计算，因此停更越久检查越少。
+        """
+        interval = sub_data["post_interval"] or self.max_poll_interval
+        if latest_post:
+            interval = max(interval, now - latest_post)
+        interval = interval / POLL_FRACTION
+        interval *= random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+        return int(min(self.max_poll_interval, max(self.min_poll_interval, interval)))
+
+    async def schedule_next(self, sub_id: str, post_times: Optional[List[int]] = None) -> bool:
+        """
+        检查完成后重新排期订阅对象，并记录检查时间
+
+        Args:
+            sub_id: 订阅对象ID
+            post_times: 画师最近作品的发布时间戳，为 None 表示本次检查失败
+
+        Returns:
+            bool: 操作是否成功
+        """
+        try:
+            sub_data = self._find(sub_id)
+            if not sub_data:
+                logger.warning(f"未找到订阅对象 {sub_id}，无法重新排期")
+                return False
+            now = int(datetime.now().timestamp())
+            if post_times is not None:
+                self._failures.pop(sub_data["user_id"], None)
+                sub_data["post_interval"] = self._estimate_post_interval(post_times) or sub_data["post_interval"]
+                sub_data["last_updated_time"] = now
+                delay = self._poll_interval(sub_data, max(post_times, default=None), now)
+            else:
+                # 连续失败（如画师已注销）时，重试间隔从最短轮询间隔开始逐次翻倍
+                failures = self._failures.get(sub_data["user_id"], 0)
+                self._failures[sub_data["user_id"]] = failures + 1
+                delay = min(self.max_poll_interval, self.min_poll_interval * 2 ** min(failures, 16))
+            sub_data["next_check_time"] = now + delay
+            heapq.heappush(self._schedule, (sub_data["next_check_time"], sub_data["user_id"]))
+            logger.debug(f"订阅对象 {sub_id} 将在 {delay // 60} 分钟后再次检查")
+            self._schedule_save()
+            return True
+        except Exception as e:
+            logger.error(f"重新排期订阅对象失败: {e}")
+            return False
+
+    def _reschedule_missed(self, subscriptions: List[SubscriptionData], started: int) -> None:
+        """回调没有重新排期的到期订阅对象（如处理时出错）按最短间隔重试，避免从调度中丢失"""
+        for sub_data in subscriptions:
+            if int(sub_data["next_check_time"]) <= started and self._find(sub_data["user_id"]) is sub_data:
+                sub_data["next_check_time"] = started + self.min_poll_interval
+                heapq.heappush(self._schedule, (sub_data["next_check_time"], sub_data["user_id"]))
+
+    async def defer_all(self, delay: int) -> None:
+        """
+        把已关注画师的下次检查时间推迟到 delay 秒之后
+
+        关注动态模式一次检查覆盖全部已关注的画师，不再按画师单独排期；尚未关注成功的画师不会出现在关注动态中，
+        仍按单独排期检查。
+        """
+        next_check_time = int(datetime.now().timestamp()) + delay
+        for sub_data in self._by_user.values():
+            if sub_data["followed"]:
+                sub_data["next_check_time"] = next_check_time
+        self._rebuild_schedule()
+        self._schedule_save()
+
+    async def mark_followed(self, sub_id: str) -> None:
+        """记录机器人账号已关注该画师"""
+        sub_data = self._find(sub_id)
+        if sub_data:
+            sub_data["followed"] = True
+            self._schedule_save()
+
+    async def renew_feed_last_id(self, new_last_id: int) -> None:
+        """更新关注动态中已处理过的最新作品ID"""
+        if new_last_id > self.feed_last_id:
+            self.feed_last_id = new_last_id
+            self._schedule_save()
+
     def set_callback(self, callback: Callable[[List[SubscriptionData]], Any]) -> None:
         """
         设置刷新回调函数
@@ -164,7 +374,10 @@ class SubscriptionCenter:
         """
         while self._is_running:
             try:
-                await asyncio.sleep(self.refresh_interval)
+                # 睡到最早到期的画师，最长不超过刷新间隔
+                delay = self.next_due_in()
+                delay = self.refresh_interval if delay is None else min(self.refresh_interval, max(MIN_TICK, delay))
+                await asyncio.sleep(delay)
                 await self._trigger_refresh()
             except asyncio.CancelledError:
                 logger.info("定时刷新任务被取消")
@@ -173,21 +386,29 @@ class SubscriptionCenter:
                 logger.error(f"定时刷新任务执行异常: {e}")
                 await asyncio.sleep(self.refresh_interval)
 
-    async def _trigger_refresh(self) -> None:
+    async def _trigger_refresh(self, force: bool = False) -> None:
         """
         触发刷新回调
+
+        Args:
+            force: 为 True 时检查全部订阅对象，否则只检查已到期的
         """
         if not self.callback:
             logger.warning("未设置回调函数，跳过刷新")
             return
 
-        if not self.subscriptions:
+        if not self._by_user:
             logger.info("暂无订阅对象，跳过刷新")
             return
 
+        subscriptions_copy = []
         try:
             # 创建订阅集合的副本，避免在回调执行期间被修改
-            subscriptions_copy = self.subscriptions.copy()
+            started = int(datetime.now().timestamp())
+            subscriptions_copy = self.subscriptions if force else self.pop_due(started)
+            if not subscriptions_copy:
+                logger.debug("暂无到期的订阅对象，跳过刷新")
+                return
             # 执行回调函数
             if asyncio.iscoroutinefunction(self.callback):
                 await self.callback(subscriptions_copy)
@@ -199,6 +420,9 @@ class SubscriptionCenter:
             logger.info("订阅刷新完成")
         except Exception as e:
             logger.error(f"刷新回调执行失败: {e}")
+        finally:
+            if subscriptions_copy:
+                self._reschedule_missed(subscriptions_copy, started)
 
     def start_timer(self) -> bool:
         """
@@ -218,7 +442,7 @@ class SubscriptionCenter:
         try:
             self._is_running = True
             self._timer_task = asyncio.create_task(self._refresh_task())
-            logger.info(f"定时器已启动，刷新间隔: {self.refresh_interval}秒")
+            logger.info(f"定时器已启动，最长刷新间隔: {self.refresh_interval}秒")
             return True
         except Exception as e:
             logger.error(f"启动定时器失败: {e}")
@@ -259,7 +483,7 @@ class SubscriptionCenter:
         """
         try:
             logger.info("手动触发订阅刷新")
-            await self._trigger_refresh()
+            await self._trigger_refresh(force=True)
             return True
         except Exception as e:
             logger.error(f"手动刷新失败: {e}")
@@ -277,44 +501,22 @@ class SubscriptionCenter:
             bool: 操作是否成功
         """
         try:
-            async with self._lock:
-                for sub_data in self.subscriptions:
-                    if sub_data["user_id"] == sub_id:
-                        sub_data["last_updated_id"] = str(new_last_id)
-                        logger.info(f"成功更新订阅对象 {sub_id} 的最后更新作品ID为 {new_last_id}")
-                        await self._save_subscriptions()
-                        return True
+            sub_data = self._find(sub_id)
+            if sub_data:
+                sub_data["last_updated_id"] = str(new_last_id)
+                logger.info(f"成功更新订阅对象 {sub_id} 的最后更新作品ID为 {new_last_id}")
+                self._schedule_save()
+                return True
             logger.warning(f"未找到订阅对象 {sub_id}，无法更新最后更新作品ID")
             return False
         except Exception as e:
             logger.error(f"更新最后更新作品ID失败: {e}")
             return False
-    async def renew_last_updated_time(self, sub_id: str) -> bool:
-        """
-        更新订阅对象的最后更新作品时间
-
-        Args:
-            sub_id: 订阅对象ID
 
-        Returns:
-            bool: 操作是否成功
-        """
-        try:
-            async with self._lock:
-                for sub_data in self.subscriptions:
-                    if sub_data["user_id"] == sub_id:
-                        sub_data["last_updated_time"] = int(datetime.now().timestamp())
-                        logger.info(f"成功更新订阅对象 {sub_id} 的最后更新作品时间")
-                        await self._save_subscriptions()
-                        return True
-            logger.warning(f"未找到订阅对象 {sub_id}，无法更新最后更新作品时间")
-            return False
-        except Exception as e:
-            logger.error(f"更新最后更新作品时间失败: {e}")
-            return False
-        
     async def cleanup(self) -> None:
         """
         清理资源
         """
-        await self.stop_timer()
+        if self._is_running:
+            await self.stop_timer()
+        await self.flush()